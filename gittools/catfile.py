@@ -0,0 +1,202 @@
+import atexit, os, subprocess, threading, time
+from collections import namedtuple
+from .refs import findGitDir
+from .utils import Sh
+
+__all__ = ['closeObjectDatabases', 'objectDatabase', 'CatFile', 'CatFileError', 'CatFilePool',
+           'CommitObject', 'ObjectDatabase', 'ObjectInfo', 'parseCommit']
+
+ObjectInfo = namedtuple('ObjectInfo', 'hash type size')
+CommitObject = namedtuple('CommitObject', 'hash parents authorTime committerTime subject')
+
+class CatFileError(Exception):
+  """The `git cat-file` process died or returned output we could not parse."""
+
+def _timestamp(ident):
+  """Returns the timestamp from an author or committer line, e.g. 'A <a@b.c> 1234 +0000'."""
+  try:
+    return int(ident.rsplit(b'>', 1)[1].split()[0])
+  except (IndexError, ValueError):
+    return None
+
+def parseCommit(hash, raw):
+  """Parses a raw commit object, as returned by `git cat-file commit`."""
+  headers, _, message = raw.partition(b'\n\n')
+  parents = []
+  authorTime = committerTime = None
+  encoding = 'utf-8'
+  for line in headers.split(b'\n'):
+    if line.startswith(b'parent '):
+      parents.append(line[7:].decode('ascii'))
+    elif line.startswith(b'author '):
+      authorTime = _timestamp(line)
+    elif line.startswith(b'committer '):
+      committerTime = _timestamp(line)
+    elif line.startswith(b'encoding '):
+      encoding = line[9:].decode('ascii')
+  # Like git's %s: the first paragraph of the message, joined onto a single line
+  try:
+    text = message.decode(encoding, 'replace')
+  except LookupError:
+    text = message.decode('utf-8', 'replace')
+  paragraph = text.lstrip('\n').split('\n\n', 1)[0]
+  subject = ' '.join(l.strip() for l in paragraph.splitlines() if l.strip())
+  return CommitObject(hash, tuple(parents), authorTime, committerTime, subject)
+
+class CatFile(object):
+  """A long-lived `git cat-file --batch` (or `--batch-check`) process.
+
+  Not thread-safe; use a CatFilePool to share processes between threads. Reads the repository
+  at gitDir if given, or else the current directory's when the process starts.
+  """
+  def __init__(self, mode = '--batch', gitDir = None):
+    gitDirArgs = () if gitDir is None else ('--git-dir=' + gitDir,)
+    self.cmd = ('/usr/local/bin/git',) + gitDirArgs + ('cat-file', mode)
+    Sh.starting(self.cmd)
+    self._contents = (mode == '--batch')
+    self._start = time.perf_counter()
+    self._bytesRead = 0
+    self._process = subprocess.Popen(self.cmd,
+                                     stdin = subprocess.PIPE,
+                                     stdout = subprocess.PIPE,
+                                     stderr = subprocess.DEVNULL)
+
+  def lookup(self, rev):
+    """Returns (ObjectInfo, contents) for rev, or None if it does not exist.
+
+    contents is None for --batch-check processes.
+    """
+    if '\n' in rev:
+      raise ValueError('Invalid revision: %s' % repr(rev))
+    try:
+      self._process.stdin.write(rev.encode('utf-8') + b'\n')
+      self._process.stdin.flush()
+      header = self._process.stdout.readline()
+    except (IOError, OSError) as e:
+      raise CatFileError(e)
+    self._bytesRead += len(header)
+    if not header.endswith(b'\n'):
+      raise CatFileError('%s exited unexpectedly' % ' '.join(self.cmd))
+    fields = header.split()
+    if len(fields) != 3:
+      # "<rev> missing" or "<rev> ambiguous"
+      return None
+    info = ObjectInfo(fields[0].decode('ascii'), fields[1].decode('ascii'), int(fields[2]))
+    if not self._contents:
+      return info, None
+    contents = self._process.stdout.read(info.size + 1)
+    self._bytesRead += len(contents)
+    if len(contents) != info.size + 1:
+      raise CatFileError('%s exited unexpectedly' % ' '.join(self.cmd))
+    return info, contents[:-1]
+
+  def close(self):
+    try:
+      self._process.stdin.close()
+    except (IOError, OSError):
+      pass
+    try:
+      self._process.wait(1.0)  # Exits as soon as it sees stdin close
+    except subprocess.TimeoutExpired:
+      self._process.kill()
+      self._process.wait()
+    except OSError:
+      pass
+    self._process.stdout.close()
+    if self._start is not None:
+      Sh.report(self.cmd, self._start, self._bytesRead, self._process.returncode)
+      self._start = None
+
+class CatFilePool(object):
+  """A thread-safe pool of CatFile processes.
+
+  Processes are started on demand, kept alive between lookups, and replaced if they fail.
+  """
+  def __init__(self, mode = '--batch', maxIdle = 4, gitDir = None):
+    self.mode = mode
+    self.maxIdle = maxIdle
+    self.gitDir = gitDir
+    self._idle = []
+    self._lock = threading.Lock()
+
+  def lookup(self, rev):
+    for attempt in (1, 2):
+      with self._lock:
+        process = self._idle.pop() if self._idle else None
+      if process is None:
+        process = CatFile(self.mode, self.gitDir)
+      try:
+        result = process.lookup(rev)
+      except CatFileError:
+        process.close()
+        if attempt == 2:
+          raise
+        continue
+      with self._lock:
+        if len(self._idle) < self.maxIdle:
+          self._idle.append(process)
+          process = None
+      if process is not None:
+        process.close()
+      return result
+
+  def close(self):
+    with self._lock:
+      idle, self._idle = self._idle, []
+    for process in idle:
+      process.close()
+
+class ObjectDatabase(object):
+  """Object lookups against a repository, served by pooled `git cat-file` processes.
+
+  gitDir is the repository's git dir; by default, whichever the current directory is in when
+  each process starts.
+  """
+  def __init__(self, gitDir = None):
+    self._contents = CatFilePool('--batch', gitDir = gitDir)
+    self._info = CatFilePool('--batch-check', gitDir = gitDir)
+
+  def info(self, rev):
+    """Returns the ObjectInfo for rev, or None if it does not exist."""
+    result = self._info.lookup(rev)
+    return result and result[0]
+
+  def resolve(self, rev):
+    """Returns the object hash rev refers to, or None if it does not exist."""
+    info = self.info(rev)
+    return info and info.hash
+
+  def commit(self, rev):
+    """Returns the CommitObject rev refers to, or None if it does not exist."""
+    result = self._contents.lookup(rev + '^{commit}')
+    if result is None:
+      return None
+    info, contents = result
+    return parseCommit(info.hash, contents)
+
+  def close(self):
+    self._contents.close()
+    self._info.close()
+
+_OBJECT_DATABASES = {}
+
+def objectDatabase():
+  """An ObjectDatabase for the current repository, or None if we are not in one.
+
+  Each repository gets its own processes, which go on reading it after a chdir elsewhere.
+  """
+  gitDir = findGitDir()
+  if gitDir is None:
+    return None
+  key = os.path.abspath(gitDir)
+  try:
+    return _OBJECT_DATABASES[key]
+  except KeyError:
+    return _OBJECT_DATABASES.setdefault(key, ObjectDatabase(key))
+
+@atexit.register
+def closeObjectDatabases():
+  """Stops every repository's `git cat-file` processes; objectDatabase() starts new ones."""
+  while _OBJECT_DATABASES:
+    _, objects = _OBJECT_DATABASES.popitem()
+    objects.close()
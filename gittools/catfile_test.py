@@ -0,0 +1,110 @@
+import subprocess
+from .catfile import closeObjectDatabases, objectDatabase, CatFilePool, ObjectDatabase, parseCommit
+from .testing import git
+from .utils import ShAccounting
+
+RAW_COMMIT = b"""tree 4b825dc642cb6eb9a060e54bf8d69288fbee4904
+parent 1111111111111111111111111111111111111111
+parent 2222222222222222222222222222222222222222
+author A U Thor <author@example.com> 1500000000 +0100
+committer C O Mitter <committer@example.com> 1500000100 +0100
+gpgsig -----BEGIN PGP SIGNATURE-----
+ 
+ -----END PGP SIGNATURE-----
+
+Merge branch 'foo'
+ into master
+
+Details go here.
+"""
+
+def make_repo(path, commits):
+  git(path, 'init', '-q')
+  for i in range(commits):
+    git(path, 'commit', '-q', '--allow-empty', '-m', 'Commit %d' % i)
+
+def test_parseCommit():
+  commit = parseCommit('abc', RAW_COMMIT)
+  assert commit.hash == 'abc'
+  assert commit.parents == ('1' * 40, '2' * 40)
+  assert commit.authorTime == 1500000000
+  assert commit.committerTime == 1500000100
+  assert commit.subject == "Merge branch 'foo' into master"
+
+def test_parseCommit_root_commit():
+  commit = parseCommit('abc', b'tree 1234\nauthor A <a> 1 +0000\ncommitter A <a> 2 +0000\n\nInit\n')
+  assert commit.parents == ()
+  assert commit.authorTime == 1
+  assert commit.subject == 'Init'
+
+def test_commit_lookups(tmp_path, monkeypatch):
+  make_repo(tmp_path, 3)
+  monkeypatch.chdir(tmp_path)
+  objects = ObjectDatabase()
+  try:
+    head = objects.commit('HEAD')
+    assert head.subject == 'Commit 2'
+    assert objects.commit(head.parents[0]).subject == 'Commit 1'
+    assert objects.resolve('HEAD~2') == objects.commit('HEAD~2').hash
+    assert objects.info('HEAD').type == 'commit'
+    assert objects.commit('does-not-exist') is None
+    assert objects.resolve('does-not-exist') is None
+  finally:
+    objects.close()
+
+def test_object_database_per_repository(tmp_path, monkeypatch):
+  first, second = tmp_path / 'first', tmp_path / 'second'
+  (second / 'sub').mkdir(parents = True)
+  first.mkdir()
+  make_repo(first, 2)
+  make_repo(second, 3)
+  for path in (first, second / 'sub', first):
+    monkeypatch.chdir(path)
+    assert objectDatabase().resolve('HEAD~1') == git(path, 'rev-parse', 'HEAD~1')
+  objects = objectDatabase()
+  processes = [p._process for p in objects._contents._idle + objects._info._idle]
+  closeObjectDatabases()
+  assert processes and all(p.returncode is not None for p in processes)
+  assert objectDatabase() is not objects
+  closeObjectDatabases()
+
+def test_pool_reuses_processes(tmp_path, monkeypatch):
+  make_repo(tmp_path, 1)
+  monkeypatch.chdir(tmp_path)
+  pool = CatFilePool('--batch-check')
+  try:
+    pool.lookup('HEAD')
+    process = pool._idle[0]
+    pool.lookup('HEAD')
+    assert pool._idle == [process]
+  finally:
+    pool.close()
+
+def test_processes_reported_on_close(tmp_path, monkeypatch):
+  make_repo(tmp_path, 1)
+  monkeypatch.chdir(tmp_path)
+  with ShAccounting() as accounting:
+    pool = CatFilePool('--batch-check')
+    pool.lookup('HEAD')
+    assert len(accounting) == 1 and not accounting.records
+    pool.close()
+  [record] = accounting.records
+  assert record.cmd[1:] == ('cat-file', '--batch-check')
+  assert record.returncode == 0
+  header = subprocess.check_output(('git', 'cat-file', '--batch-check'), input = b'HEAD\n')
+  assert record.bytesRead == len(header)
+
+def test_pool_restarts_dead_processes(tmp_path, monkeypatch):
+  make_repo(tmp_path, 1)
+  monkeypatch.chdir(tmp_path)
+  pool = CatFilePool('--batch-check')
+  try:
+    pool.lookup('HEAD')
+    dead = pool._idle[0]
+    dead._process.kill()
+    dead._process.wait()
+    info, _ = pool.lookup('HEAD')
+    assert info.type == 'commit'
+    assert pool._idle and pool._idle[0] is not dead
+  finally:
+    pool.close()
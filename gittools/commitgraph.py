@@ -0,0 +1,232 @@
+import mmap, os, struct
+from binascii import hexlify, unhexlify
+
+__all__ = ['CommitGraph', 'CommitGraphError', 'CommitGraphFile', 'commitGraphFor']
+
+class CommitGraphError(Exception):
+  """A commit-graph file was truncated or in an unsupported format."""
+
+class CommitGraphFile(object):
+  """A memory-mapped view of a single commit-graph file.
+
+  See Documentation/gitformat-commit-graph.txt in the git sources for the format. Only the
+  chunks needed for parents and generation numbers (OIDF, OIDL, CDAT, EDGE, BASE) are read;
+  values are decoded from the mapping on demand rather than copied out.
+  """
+  NO_PARENT = 0x70000000
+  EXTRA_EDGES = 0x80000000
+  LAST_EDGE = 0x80000000
+  GENERATION_MAX = 0x3FFFFFFF
+
+  def __init__(self, path):
+    self.path = path
+    with open(path, 'rb') as f:
+      self._data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    data = self._data
+    if len(data) < 8 or data[:4] != b'CGPH':
+      raise CommitGraphError('%s: not a commit-graph file' % path)
+    version, hashVersion, numChunks, self.numBases = struct.unpack_from('>BBBB', data, 4)
+    if version != 1 or hashVersion not in (1, 2):
+      raise CommitGraphError('%s: unsupported version %d/%d' % (path, version, hashVersion))
+    self.hashLength = 20 if hashVersion == 1 else 32
+    chunks = {}
+    for i in range(numChunks + 1):
+      id, offset = struct.unpack_from('>4sQ', data, 8 + 12 * i)
+      chunks[id] = offset
+    try:
+      self._fanout = chunks[b'OIDF']
+      self._oids = chunks[b'OIDL']
+      self._commitData = chunks[b'CDAT']
+    except KeyError as e:
+      raise CommitGraphError('%s: missing chunk %s' % (path, e))
+    self._edges = chunks.get(b'EDGE')
+    self._base = chunks.get(b'BASE')
+    self.numCommits = struct.unpack_from('>I', data, self._fanout + 255 * 4)[0]
+
+  def close(self):
+    self._data.close()
+
+  @property
+  def baseHashes(self):
+    """Hashes of the commit-graph files this one is layered on, base first."""
+    if self._base is None:
+      return ()
+    return tuple(hexlify(self._data[self._base + i * self.hashLength:
+                                    self._base + (i + 1) * self.hashLength]).decode('ascii')
+                 for i in range(self.numBases))
+
+  def find(self, oid):
+    """Returns the local position of the raw object id oid, or None."""
+    first = oid[0]
+    lo = struct.unpack_from('>I', self._data, self._fanout + 4 * (first - 1))[0] if first else 0
+    hi = struct.unpack_from('>I', self._data, self._fanout + 4 * first)[0]
+    data, start, length = self._data, self._oids, self.hashLength
+    while lo < hi:
+      mid = (lo + hi) // 2
+      candidate = data[start + mid * length:start + (mid + 1) * length]
+      if candidate == oid:
+        return mid
+      elif candidate < oid:
+        lo = mid + 1
+      else:
+        hi = mid
+    return None
+
+  def oid(self, pos):
+    start = self._oids + pos * self.hashLength
+    return self._data[start:start + self.hashLength]
+
+  def _record(self, pos):
+    return self._commitData + pos * (self.hashLength + 16) + self.hashLength
+
+  def parents(self, pos):
+    """Returns the global positions of the commit's parents."""
+    parent1, parent2 = struct.unpack_from('>II', self._data, self._record(pos))
+    parents = []
+    if parent1 != CommitGraphFile.NO_PARENT:
+      parents.append(parent1)
+    if parent2 == CommitGraphFile.NO_PARENT:
+      return parents
+    if not parent2 & CommitGraphFile.EXTRA_EDGES:
+      parents.append(parent2)
+      return parents
+    edge = self._edges + 4 * (parent2 & ~CommitGraphFile.EXTRA_EDGES)
+    while True:
+      value = struct.unpack_from('>I', self._data, edge)[0]
+      parents.append(value & ~CommitGraphFile.LAST_EDGE)
+      if value & CommitGraphFile.LAST_EDGE:
+        return parents
+      edge += 4
+
+  def generation(self, pos):
+    """Returns the commit's topological level, or None if git did not record a usable one."""
+    level = struct.unpack_from('>I', self._data, self._record(pos) + 8)[0] >> 2
+    if level == 0 or level >= CommitGraphFile.GENERATION_MAX:
+      return None
+    return level
+
+  def commitTime(self, pos):
+    high, low = struct.unpack_from('>II', self._data, self._record(pos) + 8)
+    return ((high & 3) << 32) | low
+
+class CommitGraph(object):
+  """A repository's commit-graph: a single file, or a chain of split files.
+
+  Positions are global across the chain, base layer first, as in git itself.
+  """
+  def __init__(self, layers):
+    self.layers = tuple(layers)
+    self._offsets = []
+    offset = 0
+    for layer in self.layers:
+      self._offsets.append(offset)
+      offset += layer.numCommits
+    self.numCommits = offset
+
+  @classmethod
+  def load(cls, objectsDir):
+    """Loads the commit-graph under objectsDir, or returns None if there is none."""
+    info = os.path.join(objectsDir, 'info')
+    chain = os.path.join(info, 'commit-graphs', 'commit-graph-chain')
+    if os.path.exists(chain):
+      with open(chain) as f:
+        hashes = [l.strip() for l in f if l.strip()]
+      return cls(CommitGraphFile(os.path.join(info, 'commit-graphs', 'graph-%s.graph' % h))
+                 for h in hashes)
+    single = os.path.join(info, 'commit-graph')
+    if os.path.exists(single):
+      return cls([CommitGraphFile(single)])
+    return None
+
+  def close(self):
+    for layer in self.layers:
+      layer.close()
+
+  def _locate(self, pos):
+    for layer, offset in zip(reversed(self.layers), reversed(self._offsets)):
+      if pos >= offset:
+        return layer, pos - offset
+    raise IndexError(pos)
+
+  def find(self, hash):
+    """Returns the global position of the commit with the given hex hash, or None."""
+    oid = unhexlify(hash)
+    for layer, offset in zip(self.layers, self._offsets):
+      pos = layer.find(oid)
+      if pos is not None:
+        return offset + pos
+    return None
+
+  def __contains__(self, hash):
+    return self.find(hash) is not None
+
+  def hash(self, pos):
+    layer, local = self._locate(pos)
+    return hexlify(layer.oid(local)).decode('ascii')
+
+  def parents(self, pos):
+    layer, local = self._locate(pos)
+    return layer.parents(local)
+
+  def generation(self, pos):
+    layer, local = self._locate(pos)
+    return layer.generation(local)
+
+  def commitTime(self, pos):
+    layer, local = self._locate(pos)
+    return layer.commitTime(local)
+
+  def generationOf(self, hash):
+    """Returns the generation number of the commit with the given hash, or None if unknown."""
+    pos = self.find(hash)
+    return None if pos is None else self.generation(pos)
+
+  def isAncestor(self, ancestor, descendant):
+    """Returns whether ancestor is reachable from descendant, or None if either is not in the graph.
+
+    Generation numbers strictly decrease from child to parent, so any commit with a lower
+    generation than ancestor cannot lead to it, and the walk never goes below it.
+    """
+    target, start = self.find(ancestor), self.find(descendant)
+    if target is None or start is None:
+      return None
+    floor = self.generation(target)
+    if floor is None:
+      floor = 0
+    seen = {start}
+    todo = [start]
+    while todo:
+      pos = todo.pop()
+      if pos == target:
+        return True
+      for parent in self.parents(pos):
+        if parent not in seen:
+          generation = self.generation(parent)
+          if generation is None or generation >= floor:
+            seen.add(parent)
+            todo.append(parent)
+    return False
+
+_CACHE = {}
+
+def commitGraphFor(objectsDir):
+  """Returns the (cached) CommitGraph under objectsDir, reloading it if git has rewritten it."""
+  info = os.path.join(objectsDir, 'info')
+  key = []
+  for path in (os.path.join(info, 'commit-graph'),
+               os.path.join(info, 'commit-graphs', 'commit-graph-chain')):
+    try:
+      st = os.stat(path)
+      key.append((st.st_ino, st.st_size, st.st_mtime_ns))
+    except OSError:
+      key.append(None)
+  key = tuple(key)
+  cached = _CACHE.get(objectsDir)
+  if cached is not None and cached[0] == key:
+    return cached[1]
+  try:
+    graph = CommitGraph.load(objectsDir)
+  except (IOError, OSError, CommitGraphError, struct.error):
+    graph = None
+  _CACHE[objectsDir] = (key, graph)
+  return graph
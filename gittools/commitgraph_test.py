@@ -0,0 +1,54 @@
+from .commitgraph import CommitGraph, commitGraphFor
+from .testing import git
+
+def make_repo(path):
+  git(path, 'init', '-q', '-b', 'master')
+  for i in range(3):
+    git(path, 'commit', '-q', '--allow-empty', '-m', 'Master %d' % i)
+  for name in ('a', 'b', 'c'):
+    git(path, 'checkout', '-q', '-b', name, 'master~1')
+    git(path, 'commit', '-q', '--allow-empty', '-m', name)
+  git(path, 'checkout', '-q', 'master')
+  git(path, 'merge', '-q', '--no-edit', 'a', 'b', 'c')  # Octopus merge uses extra edges
+
+def check_graph_matches_git(path, graph):
+  for line in git(path, 'log', '--all', '--format=%H %P').splitlines():
+    hash, *parents = line.split()
+    pos = graph.find(hash)
+    assert pos is not None
+    assert graph.hash(pos) == hash
+    assert [graph.hash(p) for p in graph.parents(pos)] == parents
+    assert all(graph.generation(p) < graph.generation(pos) for p in graph.parents(pos))
+
+def test_single_file(tmp_path):
+  make_repo(tmp_path)
+  git(tmp_path, 'commit-graph', 'write', '--reachable')
+  graph = CommitGraph.load(str(tmp_path / '.git' / 'objects'))
+  assert graph.numCommits == 7
+  check_graph_matches_git(tmp_path, graph)
+  assert graph.find('0' * 40) is None
+
+def test_split_chain(tmp_path):
+  make_repo(tmp_path)
+  git(tmp_path, 'commit-graph', 'write', '--reachable', '--split')
+  git(tmp_path, 'commit', '-q', '--allow-empty', '-m', 'Master 4')
+  git(tmp_path, 'commit-graph', 'write', '--reachable', '--split=no-merge')
+  graph = CommitGraph.load(str(tmp_path / '.git' / 'objects'))
+  assert len(graph.layers) == 2
+  assert graph.numCommits == 8
+  check_graph_matches_git(tmp_path, graph)
+
+def test_isAncestor(tmp_path):
+  make_repo(tmp_path)
+  git(tmp_path, 'commit-graph', 'write', '--reachable')
+  graph = CommitGraph.load(str(tmp_path / '.git' / 'objects'))
+  master, a, root = git(tmp_path, 'rev-parse', 'master', 'a', 'master~1~1').splitlines()
+  b = git(tmp_path, 'rev-parse', 'b')
+  assert graph.isAncestor(a, master)
+  assert graph.isAncestor(root, a)
+  assert not graph.isAncestor(a, b)
+  assert not graph.isAncestor(master, a)
+
+def test_commitGraphFor_missing(tmp_path):
+  git(tmp_path, 'init', '-q')
+  assert commitGraphFor(str(tmp_path / '.git' / 'objects')) is None
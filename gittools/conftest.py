@@ -0,0 +1,33 @@
+import os
+import pytest
+from .catfile import closeObjectDatabases
+from .dag import COMMITS
+from .testing import forgetLazyResults
+
+# Tests marked benchmark assert on wall-clock time, which is unreliable on slow or loaded
+# machines, so they only run when asked for, e.g. GITTOOLS_BENCHMARKS=1 pytest -m benchmark
+def pytest_configure(config):
+  config.addinivalue_line(
+      'markers', 'benchmark: asserts on wall-clock time; only runs with GITTOOLS_BENCHMARKS=1')
+
+def pytest_collection_modifyitems(config, items):
+  if os.environ.get('GITTOOLS_BENCHMARKS'):
+    return
+  skip = pytest.mark.skip(reason = 'wall-clock benchmark; set GITTOOLS_BENCHMARKS=1 to run')
+  for item in items:
+    if 'benchmark' in item.keywords:
+      item.add_marker(skip)
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+  """An empty directory to create a git repository in, made the current directory.
+
+  Lazy results read from git are forgotten before and after the test, and the git processes
+  left reading the repository are stopped after it.
+  """
+  monkeypatch.chdir(tmp_path)
+  forgetLazyResults()
+  yield tmp_path
+  COMMITS.close()
+  closeObjectDatabases()
+  forgetLazyResults()
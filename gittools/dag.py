@@ -0,0 +1,146 @@
+import atexit, threading
+from array import array
+from .catfile import objectDatabase, CommitObject
+from .utils import Sh, ShError
+
+__all__ = ['COMMITS', 'CommitDAG']
+
+class CommitDAG(object):
+  """A shared, append-only table of commits, filled by streaming `git log` over many tips.
+
+  Each commit is stored once, however many branches contain it, so memory and load time
+  scale with the number of unique commits rather than branches × history length. Streams are
+  consumed lazily: a lookup only reads as far into `git log`'s output as it needs to.
+  Commits are immutable, so the table is never invalidated; new tips are loaded
+  incrementally, excluding history that has already been streamed in full.
+
+  Only one `git log` runs at a time. Loading new tips replaces it with one that also covers
+  the tips it had not finished, so partly-read streams are closed and reaped rather than left
+  open for the life of a long-running process.
+  """
+  FORMAT = '%H:%P:%at:%ct:%s'
+
+  def __init__(self):
+    self._index = {}
+    self._hashes = []
+    self._firstParents = array('q')  # -1 for root commits
+    self._otherParents = {}  # Only merge commits have entries
+    self._authorTimes = array('q')
+    self._committerTimes = array('q')
+    self._subjects = []
+    self._loaded = bytearray()
+    self._requested = set()
+    self._complete = set()  # Tips whose entire history has been loaded
+    self._pending = []  # Tips the current stream is loading
+    self._stream = None  # The Sh running `git log` over _pending, if any
+    self._batches = None
+    self._lock = threading.RLock()
+
+  def __len__(self):
+    return sum(self._loaded)
+
+  def __contains__(self, hash):
+    idx = self._index.get(hash)
+    return idx is not None and bool(self._loaded[idx])
+
+  def _intern(self, hash):
+    idx = self._index.get(hash)
+    if idx is None:
+      idx = self._index[hash] = len(self._hashes)
+      self._hashes.append(hash)
+      self._firstParents.append(-1)
+      self._authorTimes.append(0)
+      self._committerTimes.append(0)
+      self._subjects.append(None)
+      self._loaded.append(0)
+    return idx
+
+  def _add(self, hash, parents, authorTime, committerTime, subject):
+    idx = self._intern(hash)
+    if self._loaded[idx]:
+      return idx
+    parentIdxs = [self._intern(p) for p in parents]
+    if parentIdxs:
+      self._firstParents[idx] = parentIdxs[0]
+    if len(parentIdxs) > 1:
+      self._otherParents[idx] = tuple(parentIdxs[1:])
+    self._authorTimes[idx] = authorTime or 0
+    self._committerTimes[idx] = committerTime or 0
+    self._subjects[idx] = subject
+    self._loaded[idx] = 1
+    return idx
+
+  def _parse(self, line):
+    hash, parents, authorTime, committerTime, subject = line.split(':', 4)
+    self._add(hash, parents.split(), int(authorTime), int(committerTime), subject.strip())
+
+  def load(self, tips):
+    """Starts streaming the history of tips, skipping history already streamed in full."""
+    with self._lock:
+      tips = [t for t in dict.fromkeys(tips) if t not in self._requested and t not in self]
+      if not tips:
+        return
+      self._requested.update(tips)
+      pending = tips + self._pending
+      self._stop()
+      self._pending = pending
+      # Revisions go on stdin, as the exclusions grow with every tip loaded
+      revisions = pending + ['^' + t for t in sorted(self._complete)]
+      self._stream = Sh('/usr/local/bin/git', 'log', '--format=' + CommitDAG.FORMAT, '--stdin',
+                        input = ''.join(r + '\n' for r in revisions).encode('utf-8'))
+      self._batches = self._stream.batches()
+
+  def _pull(self, idx):
+    """Reads streamed history until the commit at idx has been loaded, or the stream ends."""
+    while not self._loaded[idx] and self._stream is not None:
+      try:
+        for line in next(self._batches):
+          self._parse(line)
+      except StopIteration:
+        self._complete.update(self._pending)
+        self._stop()
+      except ShError:
+        self._stop()  # Lookups fall back to cat-file
+
+  def _stop(self):
+    stream, self._stream, self._batches, self._pending = self._stream, None, None, []
+    if stream is not None:
+      stream.__exit__(None, None, None)  # Kills and reaps the process, if still running
+
+  def close(self):
+    """Stops the current `git log`, if any. Tips it had not finished may be loaded again."""
+    with self._lock:
+      self._requested.difference_update(self._pending)
+      self._stop()
+
+  def commit(self, hash):
+    """Returns the CommitObject for hash, or None if no such commit exists."""
+    with self._lock:
+      idx = self._intern(hash)
+      self._pull(idx)
+      if not self._loaded[idx]:
+        objects = objectDatabase()
+        commit = objects and objects.commit(hash)
+        if commit is None or commit.hash != hash:
+          return commit
+        self._add(*commit)
+      return self._commitAt(idx)
+
+  def _commitAt(self, idx):
+    first = self._firstParents[idx]
+    parents = () if first == -1 else (first,) + self._otherParents.get(idx, ())
+    return CommitObject(self._hashes[idx],
+                        tuple(self._hashes[p] for p in parents),
+                        self._authorTimes[idx],
+                        self._committerTimes[idx],
+                        self._subjects[idx])
+
+  def firstParentHistory(self, hash):
+    """Yields the CommitObjects on hash's first-parent chain, newest first."""
+    commit = self.commit(hash)
+    while commit is not None:
+      yield commit
+      commit = self.commit(commit.parents[0]) if commit.parents else None
+
+COMMITS = CommitDAG()
+atexit.register(COMMITS.close)
@@ -0,0 +1,72 @@
+import pytest
+from .dag import CommitDAG
+from .testing import git
+
+def make_repo(path):
+  """Creates master with three commits, and feature forked from the second, then merged."""
+  git(path, 'init', '-q', '-b', 'master')
+  for i in range(2):
+    git(path, 'commit', '-q', '--allow-empty', '-m', 'Master %d' % i)
+  git(path, 'checkout', '-q', '-b', 'feature')
+  git(path, 'commit', '-q', '--allow-empty', '-m', 'Feature 0')
+  git(path, 'checkout', '-q', 'master')
+  git(path, 'commit', '-q', '--allow-empty', '-m', 'Master 2')
+  git(path, 'checkout', '-q', 'feature')
+  git(path, 'merge', '-q', '--no-edit', '--no-ff', 'master')
+
+@pytest.fixture
+def dag(repo):
+  """A CommitDAG over a repository made by make_repo, whose `git log` is stopped afterwards."""
+  make_repo(repo)
+  dag = CommitDAG()
+  yield dag
+  dag.close()
+
+def first_parents(path, rev):
+  return git(path, 'log', '--first-parent', '--format=%H', rev).splitlines()
+
+def test_first_parent_history(repo, dag):
+  master, feature = git(repo, 'rev-parse', 'master', 'feature').splitlines()
+  dag.load([master, feature])
+  history = list(dag.firstParentHistory(feature))
+  assert [c.hash for c in history] == first_parents(repo, feature)
+  assert history[0].subject == "Merge branch 'master' into feature"
+  assert history[0].parents[1] == master
+  assert [c.hash for c in dag.firstParentHistory(master)] == first_parents(repo, master)
+  assert len(dag) == 5
+
+def test_shared_history_is_loaded_once(repo, dag):
+  master, feature = git(repo, 'rev-parse', 'master', 'feature').splitlines()
+  dag.load([master, feature])
+  list(dag.firstParentHistory(feature))
+  list(dag.firstParentHistory(master))
+  stream = dag._stream
+  dag.load([master, feature])
+  assert dag._stream is stream
+
+def test_incremental_load_excludes_known_history(repo, dag):
+  master = git(repo, 'rev-parse', 'master')
+  dag.load([master])
+  assert dag.commit('0' * 40) is None  # Reads master's history to the end
+  git(repo, 'checkout', '-q', 'master')
+  git(repo, 'commit', '-q', '--allow-empty', '-m', 'Master 3')
+  newMaster = git(repo, 'rev-parse', 'master')
+  dag.load([newMaster])
+  assert not any(arg.startswith('^') for arg in dag._stream.cmd)
+  assert [line for batch in dag._batches for line in batch] == [line for line in git(
+      repo, 'log', '--format=' + CommitDAG.FORMAT, newMaster, '^' + master).splitlines()]
+
+def test_partly_read_stream_is_reaped_when_replaced(repo, dag):
+  master, feature = git(repo, 'rev-parse', 'master', 'feature').splitlines()
+  dag.load([master])
+  dag.commit(master)
+  process = dag._stream._process
+  dag.load([feature])
+  assert process.returncode is not None
+  assert [c.hash for c in dag.firstParentHistory(master)] == first_parents(repo, master)
+  assert [c.hash for c in dag.firstParentHistory(feature)] == first_parents(repo, feature)
+  dag.close()
+  assert dag._stream is None
+
+def test_unknown_commit(repo, dag):
+  assert dag.commit('0' * 40) is None
@@ -0,0 +1,43 @@
+import json, os, re, subprocess, sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that are slow to import and only needed by some modes, e.g. --watch or CI statuses
+DEFERRED_MODULES = ('travispy', 'watchdog', 'multiprocessing.pool', 'concurrent.futures.thread')
+
+# Generous, to stay reliable on loaded machines; typical imports take a few tens of ms
+IMPORT_BUDGET_SECONDS = 1.0
+
+def entryPoints():
+  with open(os.path.join(ROOT, 'pyproject.toml')) as f:
+    section = f.read().split('[tool.poetry.scripts]', 1)[1].split('\n[', 1)[0]
+  return re.findall(r'^([\w-]+)\s*=\s*"([\w.]+):(\w+)"', section, re.MULTILINE)
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1], fromlist = [sys.argv[2]])
+getattr(module, sys.argv[2])
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))
+'''
+
+def importEntryPoint(module, function):
+  output = subprocess.check_output((sys.executable, '-c', PROBE, module, function), cwd = ROOT)
+  return json.loads(output.decode('utf-8'))
+
+def test_entry_points_found():
+  assert 'git-graph-branch' in dict((name, module) for name, module, _ in entryPoints())
+
+@pytest.mark.parametrize('name,module,function', entryPoints())
+def test_entry_point_startup(name, module, function):
+  result = importEntryPoint(module, function)
+  loaded = [m for m in DEFERRED_MODULES
+            if any(l == m or l.startswith(m + '.') for l in result['modules'])]
+  assert loaded == [], '%s imports %s at startup' % (name, ', '.join(loaded))
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('name,module,function', entryPoints())
+def test_entry_point_import_time(name, module, function):
+  assert importEntryPoint(module, function)['elapsed'] < IMPORT_BUDGET_SECONDS, name
@@ -1,14 +1,20 @@
-import os.path, re, threading, watchdog.events
+import os.path, re, threading
 from collections import defaultdict, namedtuple
 from datetime import datetime, timedelta
 from fnmatch import fnmatch
-from functools import update_wrapper
+from functools import partial, update_wrapper
+from itertools import islice
+from .catfile import objectDatabase
+from .commitgraph import commitGraphFor
+from .dag import COMMITS
 from .lazy import lazy
-from .multiobserver import OBSERVER
-from .utils import first, fractionalSeconds, staticproperty, LazyList, Sh, ShError
+from .multiobserver import OBSERVER, FileSystemEventHandler
+from .refs import findGitDir, RefSnapshot, RefStore
+from .utils import fractionalSeconds, staticproperty, LazyList, Sh, ShError
 
-__all__ = [ 'getUpstreamBranch', 'git_dir', 'lazy_git_property', 'revparse',
-            'Branch', 'GitListener', 'GitLockWatcher' ]
+__all__ = [ 'deltaHistory', 'firstParentHistory', 'forkPoint', 'generation', 'generationLookup',
+            'getUpstreamBranch', 'git_dir', 'lazy_git_property', 'refSnapshot', 'refStore',
+            'revparse', 'Branch', 'GitListener', 'GitLockWatcher', 'HistorySet' ]
 
 # wait(None) blocks signals like KeyboardInterrupt
 # Use wait(99999) instead
@@ -18,7 +24,7 @@ INDEFINITELY = 99999
 def git_dir():
   return revparse("--git-dir")
 
-class GitLockWatcher(watchdog.events.FileSystemEventHandler):
+class GitLockWatcher(FileSystemEventHandler):
   def __init__(self, latency = timedelta(seconds = 0.5)):
     self.lockfile = os.path.join(git_dir(), 'index.lock')
     self.latency = latency
@@ -69,8 +75,40 @@ class GitLockWatcher(watchdog.events.FileSystemEventHandler):
     if event.dest_path == self.lockfile:
       self._lock()
 
+_REF_STORES = {}
+
+def refStore():
+  """A RefStore for the current repository, or None if we are not in one."""
+  gitDir = findGitDir()
+  if gitDir is None:
+    return None
+  key = os.path.abspath(gitDir)
+  try:
+    return _REF_STORES[key]
+  except KeyError:
+    return _REF_STORES.setdefault(key, RefStore(key))
+
+def _isPlainRevision(arg):
+  return not arg.startswith(('-', '^')) and '..' not in arg
+
 def revparse(*args):
-  """Returns the result of `git rev-parse *args`."""
+  """Returns the result of `git rev-parse *args`.
+
+  Ref lookups and the git dir are read directly from disk where possible, and other plain
+  revisions are resolved by a long-lived `git cat-file` process; anything more complex is
+  passed through to a fresh `git rev-parse`.
+
+  """
+  store = refStore()
+  if store is not None:
+    result = store.revparse(*args)
+    if result is not None:
+      return result
+  objects = objectDatabase()
+  if objects is not None and args and all(_isPlainRevision(arg) for arg in args):
+    hashes = [objects.resolve(arg) for arg in args]
+    if all(hashes):
+      return '\n'.join(hashes)
   try:
     return str(Sh("/usr/local/bin/git", "rev-parse", *args)).strip()
   except ShError as e:
@@ -83,10 +121,155 @@ def getUpstreamBranch(branch):
   except ValueError:
     return None
 
+def firstParentHistory(rev):
+  """Yields the CommitObjects on rev's first-parent chain, newest first.
+
+  History is served from the shared COMMITS table. The first lookup streams the history of
+  every branch in one `git log`, so later branches are cheap views onto the same commits.
+  """
+  try:
+    hash = revparse(rev)
+  except ValueError:
+    return
+  if hash not in COMMITS:
+    refs = refSnapshot()
+    COMMITS.load([hash] + [refs.hash(name) for name in refs.branches + refs.remotes])
+  yield from COMMITS.firstParentHistory(hash)
+
+def generationLookup():
+  """Returns a function mapping commit hashes to generation numbers, or None if unavailable.
+
+  Finding the commit-graph stats the git dir, so walks should look it up once, not per commit.
+  """
+  store = refStore()
+  graph = store and commitGraphFor(os.path.join(store.commonDir, 'objects'))
+  return graph and graph.generationOf
+
+def generation(hash):
+  """Returns the generation number git's commit-graph records for hash, or None if unknown."""
+  lookup = generationLookup()
+  return lookup and lookup(hash)
+
+class HistorySet(object):
+  """The union of several first-parent histories, walked only as far as membership tests need.
+
+  generation, if given, maps a commit hash to its generation number (None if unknown).
+  Generation numbers strictly decrease down a history, so once a history has passed below a
+  commit's generation it cannot contain that commit. Commits missing from the commit-graph
+  are newer than everything in it, so count as infinitely high. Without generation numbers,
+  a failed membership test walks every history to the end.
+  """
+  INFINITY = float('inf')
+
+  def __init__(self, histories, generation = None):
+    self._frontiers = [[iter(h), HistorySet.INFINITY] for h in histories]
+    self._hashes = set()
+    self._generation = generation
+
+  def _generationOf(self, hash):
+    g = self._generation(hash)
+    return HistorySet.INFINITY if g is None else g
+
+  def __contains__(self, hash):
+    if hash in self._hashes:
+      return True
+    target = self._generationOf(hash) if self._generation else None
+    for frontier in self._frontiers:
+      while frontier[0] is not None and (target is None or frontier[1] >= target):
+        c = next(frontier[0], None)
+        if c is None:
+          frontier[0] = None
+          break
+        self._hashes.add(c.hash)
+        if target is not None:
+          frontier[1] = self._generationOf(c.hash)
+        if c.hash == hash:
+          return True
+    return False
+
+  def containsAny(self, hashes):
+    return any(hash in self for hash in hashes)
+
+def forkPoint(history, upstreamHistory, upstreamRefLog = (), generation = None):
+  """Returns the most recent commit in history that it shares with upstreamHistory, or None.
+
+  Both histories are first-parent chains, newest first, so once they meet they share every
+  later commit; both are walked in lockstep only as far as that meeting point. As in
+  `git pull`, a commit upstream previously pointed to (according to upstreamRefLog) also
+  counts as shared, to detect rebases of the upstream branch. generation, if given, is used
+  to cut short the search for reflog entries further down the shared history.
+
+  """
+  branchOrder, branchIdx = [], {}
+  upstreamOrder, upstreamIdx = [], {}
+  branchIter, upstreamIter = iter(history), iter(upstreamHistory)
+  fork = None
+  while fork is None and (branchIter or upstreamIter):
+    if branchIter:
+      c = next(branchIter, None)
+      if c is None:
+        branchIter = None
+      else:
+        branchIdx[c.hash] = len(branchOrder)
+        branchOrder.append(c)
+        if c.hash in upstreamIdx:
+          fork = c.hash
+    if fork is None and upstreamIter:
+      u = next(upstreamIter, None)
+      if u is None:
+        upstreamIter = None
+      else:
+        upstreamIdx[u.hash] = len(upstreamOrder)
+        upstreamOrder.append(u.hash)
+        if u.hash in branchIdx:
+          fork = u.hash
+
+  if fork is None:
+    forkCommit = None
+    private = branchIdx
+    upstreamPrivate = upstreamIdx
+    shared = frozenset()
+  else:
+    forkCommit = branchOrder[branchIdx[fork]]
+    private = {h: i for h, i in branchIdx.items() if i < branchIdx[fork]}
+    upstreamPrivate = frozenset(upstreamOrder[:upstreamIdx[fork]])
+    shared = (frozenset(h for h, i in branchIdx.items() if i >= branchIdx[fork])
+              | frozenset(upstreamOrder[upstreamIdx[fork]:]))
+
+  unplaced = set()  # Earlier reflog entries that may be further down the shared history
+  for entry in upstreamRefLog:
+    if entry.hash in shared:
+      return forkCommit
+    if entry.hash in private:
+      if unplaced and upstreamIter and HistorySet([upstreamIter], generation).containsAny(unplaced):
+        return forkCommit
+      return branchOrder[private[entry.hash]]
+    if entry.hash not in upstreamPrivate:
+      unplaced.add(entry.hash)
+  return forkCommit
+
+def deltaHistory(history, oldTip, generation = None):
+  """Returns the commits in history above oldTip, newest first, or None if oldTip is not in it.
+
+  generation, if given, is used to stop early when history has been rewritten.
+  """
+  floor = generation(oldTip) if generation else None
+  delta = []
+  for c in history:
+    if c.hash == oldTip:
+      return delta
+    if floor is not None:
+      g = generation(c.hash)
+      if g is not None and g <= floor:
+        return None
+    delta.append(c)
+  return None
+
 RefLine = namedtuple('RefLine', 'timestamp hash')
+UnmergedState = namedtuple('UnmergedState', 'tip parents upstreamCommit prefixes')
 Commit = namedtuple("Commit", "hash subject merges")
 
-class GitListener(watchdog.events.FileSystemEventHandler):
+class GitListener(FileSystemEventHandler):
   """
   Listens for git filesystem events.
 
@@ -136,18 +319,23 @@ class GitListener(watchdog.events.FileSystemEventHandler):
     if event.is_directory:
       pass
     elif self.path_matches(os.path.relpath(event.src_path, self._abs_root_dir)):
-      self._callback()
+      self._callback(event.src_path)
     else:
       try:
         if self.path_matches(os.path.relpath(event.dest_path, self._abs_root_dir)):
-          self._callback()
-      except AttributeError:
+          self._callback(event.dest_path)
+      except (AttributeError, ValueError):  # Only moves have a dest_path
         pass
 
 def lazy_git_function(watching):
   return lazy(listener = GitListener(include_globs = watching))
 
-class LazyGitProperty(watchdog.events.FileSystemEventHandler, property):
+@lazy_git_function(watching = ['refs/*', 'packed-refs', 'config'])
+def refSnapshot():
+  """A RefSnapshot of all local and remote branches, shared by every Branch property."""
+  return RefSnapshot.load()
+
+class LazyGitProperty(FileSystemEventHandler, property):
   """
   Base class for properties that provide information about a git repository.
 
@@ -177,7 +365,7 @@ class LazyGitProperty(watchdog.events.FileSystemEventHandler, property):
   def watch(self, obj, storage, callback):
     root_dir = self._root_dir
     watching = self.substitute(obj, self._watching)
-    class handler(watchdog.events.FileSystemEventHandler):
+    class handler(FileSystemEventHandler):
       def path_matches(self, rel_path):
         return any(fnmatch(rel_path, g) for g in watching)
 
@@ -185,12 +373,12 @@ class LazyGitProperty(watchdog.events.FileSystemEventHandler, property):
         if event.is_directory:
           pass
         elif self.path_matches(os.path.relpath(event.src_path, root_dir)):
-          callback()
+          callback(event.src_path)
         else:
           try:
             if self.path_matches(os.path.relpath(event.dest_path, root_dir)):
-              callback()
-          except AttributeError:
+              callback(event.dest_path)
+          except (AttributeError, ValueError):  # Only moves have a dest_path
             pass
     storage.handler = handler()
     OBSERVER.schedule(storage.handler, '.git')
@@ -230,16 +418,28 @@ class Branch:
   @lazy_git_function(watching = ['refs/heads/*'])
   def ALL():
     """The set of all (local) branches."""
-    names = revparse("--abbrev-ref", "--branches").splitlines()
-    return frozenset(Branch(name) for name in names)
+    return frozenset(Branch(name) for name in refSnapshot().branches)
+
+  @staticproperty
+  @lazy
+  def _CHILDREN():
+    """Maps each branch to the branches which have it as upstream or merged.
+
+    Built in one pass over every branch's parents, and recomputed whenever any of them change.
+    """
+    children = defaultdict(set)
+    for b in Branch.ALL:
+      for p in b.parents:
+        children[p].add(b)
+    return {p: frozenset(c) for p, c in children.items()}
 
   @staticproperty
   @lazy_git_function(watching = ['refs/remotes/*'])
   def REMOTES():
     """The set of all remote branches that have a local branch of the same name."""
-    names = revparse("--abbrev-ref", "--remotes").splitlines()
     locals = frozenset(b.name for b in Branch.ALL)
-    return frozenset(Branch(name) for name in names if name.split('/', 1)[-1] in locals)
+    return frozenset(Branch(name) for name in refSnapshot().remotes
+                     if name.split('/', 1)[-1] in locals)
 
   def __new__(cls, name):
     if name == 'HEAD':
@@ -264,16 +464,71 @@ class Branch:
   def fullName(self):
     return revparse('--symbolic-full-name', self.name)
 
-  @lazy_git_property(watching = 'logs/%fullName%')
-  def _refLog(self):
+  def _refLogCommand(self):
+    return ("/usr/local/bin/git", "log", "-g", "%s@{now}" % self.name,
+            "--date=raw", "--format=%gd %H")
+
+  @staticmethod
+  def _parseRefLog(lines):
+    matches = (Branch._REFLOG_RE.search(l) for l in lines)
+    return tuple(RefLine(int(m.group(1)), m.group(2)) for m in matches if m)
+
+  @staticmethod
+  def _loadRefLog(cmd):
     try:
-      rawlog = Sh("/usr/local/bin/git", "log", "-g", "%s@{now}" % self.name,
-                  "--date=raw", "--format=%gd %H")
-      matches = (Branch._REFLOG_RE.search(l) for l in rawlog)
-      return tuple(RefLine(int(m.group(1)), m.group(2)) for m in matches if m)
+      return Branch._parseRefLog(Sh(*cmd))
     except ShError:
       return ()
 
+  @lazy_git_property(watching = 'logs/%fullName%')
+  def _refLog(self):
+    return Branch._loadRefLog(self._refLogCommand())
+
+  # Loaders mostly wait on git processes, which need a core each to run in parallel
+  PREFETCH_WORKERS = min(8, os.cpu_count() or 1)
+
+  @staticmethod
+  def prefetch(branches):
+    """Loads the data a walk over branches will need in parallel, priming lazy properties.
+
+    Walking branches one at a time blocks on each branch's git commands in turn. Instead, the
+    inputs of each loader are worked out here from the ref snapshot, the loaders run on a
+    thread pool, and their results are primed into lazy properties back on the main thread.
+    Loaders only see plain values, never lazy ones, as those may only be touched on the main
+    thread. Anything already computed is left alone, so this is cheap to call before any walk
+    over branches.
+    """
+    refs = refSnapshot()
+    branches = set(branches)
+    upstreams = {b.upstream for b in branches if b.upstream is not None}
+    refLogTodo = [b for b in upstreams if not Branch._refLog.is_cached(b)]
+    tips = [refs.hash(b.name) for b in branches | upstreams
+            if not Branch.allCommits.is_cached(b) and refs.hash(b.name)]
+    if not refLogTodo and not tips:
+      return
+    store = refStore()
+    allTips = [refs.hash(name) for name in refs.branches + refs.remotes]
+
+    def loadCommits():
+      COMMITS.load(tips + allTips)
+      for tip in tips:
+        COMMITS.commit(tip)
+
+    def loadCommitGraph():
+      if store is not None:
+        commitGraphFor(os.path.join(store.commonDir, 'objects'))
+
+    loaders = [loadCommits, loadCommitGraph]
+    loaders.extend(partial(Branch._loadRefLog, b._refLogCommand()) for b in refLogTodo)
+    if Branch.PREFETCH_WORKERS > 1:
+      from concurrent.futures import ThreadPoolExecutor
+      with ThreadPoolExecutor(max_workers = Branch.PREFETCH_WORKERS) as pool:
+        results = list(pool.map(lambda loader: loader(), loaders))
+    else:
+      results = [loader() for loader in loaders]
+    for branch, refLog in zip(refLogTodo, results[2:]):
+      Branch._refLog.prime(branch, refLog)
+
   @lazy_git_property(watching = '%fullName%')
   def allCommits(self):
     """All commits made to this branch, in reverse chronological order.
@@ -281,9 +536,8 @@ class Branch:
     Merges will only list commit hashes, not branches.
 
     """
-    raw = Sh("/usr/local/bin/git", "log", "--first-parent", "--format=%H:%P:%s", self.name, "--")
-    commits = (Commit(h, s.strip(), m.split(" ")[1:]) for h, m, s in
-               (l.split(":", 2) for l in raw))
+    commits = (Commit(c.hash, c.subject, list(c.parents[1:]))
+               for c in firstParentHistory(self.name))
     return LazyList(commits)
 
   @lazy
@@ -292,10 +546,11 @@ class Branch:
     """The latest commit made to this branch."""
     return self.allCommits[0]
 
-  @lazy_git_property(watching = 'config')
+  @lazy
+  @property
   def upstream(self):
     """The branch set as this branch's 'upstream', or None if none is set."""
-    upstreamName = getUpstreamBranch(self.name)
+    upstreamName = refSnapshot().upstream(self.name)
     return None if upstreamName is None else Branch(upstreamName)
 
   @lazy
@@ -309,19 +564,18 @@ class Branch:
     """
     if self.upstream is None:
       return None
-    commitHashes = set(c.hash for c in self.allCommits)
-    firstUpstreamReference = first(h.hash for h in self.upstream._refLog if h.hash in commitHashes)
-    upstreamCommitHashes = set(c.hash for c in self.upstream.allCommits)
-    return first(c for c in self.allCommits
-                 if c.hash in upstreamCommitHashes or c.hash == firstUpstreamReference)
+    return forkPoint(self.allCommits, self.upstream.allCommits, self.upstream._refLog,
+                     generationLookup())
 
   @lazy
   @property
   def commits(self):
     """All commits made to this branch since it left upstream, including merges."""
+    # Read now, not as the list is consumed, so this is invalidated along with them
+    allCommits, upstreamCommit = self.allCommits, self.upstreamCommit
     def impl():
-      for c in self.allCommits:
-        if c == self.upstreamCommit:
+      for c in allCommits:
+        if c == upstreamCommit:
           return
         mergedBranches = [Branch(name) for name in Branch._mergedBranches(c.subject)]
         if mergedBranches:
@@ -344,35 +598,88 @@ class Branch:
   @property
   def children(self):
     """All branches which have this branch as upstream or merged."""
-    return frozenset(b for b in type(self).ALL if self in b.parents)
+    return Branch._CHILDREN.get(self, frozenset())
 
-  @lazy_git_property(watching = 'refs/heads/%name%')
+  @lazy
+  @property
   def modtime(self):
     """The timestamp of the latest commit to this branch."""
-    with Sh("/usr/local/bin/git", "log", "-n5", "--format=%at", self.name, "--") as log:
-      for line in log:
-        modtime = int(line)
-        if modtime != 1:
-          return datetime.utcfromtimestamp(modtime)
+    ref = refSnapshot().get(self.name)
+    if ref is not None and ref.authorTime not in (None, 1):
+      return datetime.utcfromtimestamp(ref.authorTime)
+    for commit in islice(firstParentHistory(self.name), 5):
+      if commit.authorTime != 1:
+        return datetime.utcfromtimestamp(commit.authorTime)
     return None
 
-  @lazy_git_property(watching = 'refs/heads/%name%')
-  def unmerged(self):
-    """The number of parent commits that have not been pulled to this branch."""
-    if self.upstream is None:
-      return 0
-    allCommits = set(c.hash for c in self.allCommits)
+  _unmergedState = None
+
+  def _reachableCommits(self):
+    """A HistorySet of every commit on this branch, including merged branches."""
+    histories = [self.allCommits]
     if len(self.parents) > 1:
       for c in self.allCommits:
         if c == self.upstreamCommit:
           break
-        for rev in c.merges:
-          allCommits.update(Sh("/usr/local/bin/git", "log", "--first-parent", "--format=%H", rev))
-    parentCommits = set()
+        histories.extend(firstParentHistory(rev) for rev in c.merges)
+    return HistorySet(histories, generationLookup())
+
+  @lazy_git_property(watching = 'refs/heads/%name%')
+  def unmerged(self):
+    """The number of parent commits that have not been pulled to this branch.
+
+    The unmerged commits of each parent are remembered between evaluations. If this branch
+    and its parents have only moved forward since then, only the new commits are walked.
+
+    """
+    if self.upstream is None:
+      self._unmergedState = None
+      return 0
+    state = self._unmergedState
+    generation = generationLookup()
+    tip = next((c.hash for c in self.allCommits), None)
+    if state is not None and (state.parents != self.parents
+                              or state.upstreamCommit != self.upstreamCommit):
+      state = None
+    newCommits = ()
+    if state is not None and state.tip != tip:
+      newCommits = deltaHistory(self.allCommits, state.tip, generation)
+      if newCommits is None or any(c.merges for c in newCommits):
+        state = None
+    newHashes = frozenset(c.hash for c in newCommits or ())
+
+    reachable = []
+    def isReachable(hash):
+      if not reachable:
+        reachable.append(self._reachableCommits())
+      return hash in reachable[0]
+
+    prefixes = {}
     for p in self.parents:
-      for c in p.allCommits:
-        if c.hash in allCommits:
-          break
-        parentCommits.add(c.hash)
-    return len(parentCommits)
+      parentTip = next((c.hash for c in p.allCommits), None)
+      prefix = None
+      if state is not None and p in state.prefixes:
+        oldTip, oldPrefix = state.prefixes[p]
+        delta = [] if parentTip == oldTip else deltaHistory(p.allCommits, oldTip, generation)
+        if delta is not None:
+          # Old unmerged commits can only have been merged by this branch's new commits
+          prefix = []
+          for c in delta:
+            if isReachable(c.hash):
+              break
+            prefix.append(c.hash)
+          else:
+            for hash in oldPrefix:
+              if hash in newHashes:
+                break
+              prefix.append(hash)
+      if prefix is None:
+        prefix = []
+        for c in p.allCommits:
+          if isReachable(c.hash):
+            break
+          prefix.append(c.hash)
+      prefixes[p] = (parentTip, tuple(prefix))
+    self._unmergedState = UnmergedState(tip, self.parents, self.upstreamCommit, prefixes)
+    return len(frozenset(hash for _, prefix in prefixes.values() for hash in prefix))
 
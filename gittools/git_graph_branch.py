@@ -11,19 +11,34 @@ Symbols:
 Options:
     -h --help               Show this screen.
     -w, --watch             Continue to watch for git repo changes after printing the graph.
-    --profile               Profiles the app.
+                            Graphs taller than the terminal scroll with j/k, space/b and g/G.
+    --profile               Print the graph, then a breakdown of where the time went by phase
+                            and by subprocess to stderr.
+    --trace=<file>          Like --profile, also writing a trace of each phase and subprocess
+                            to file, for chrome://tracing or speedscope.app.
+    --daemon                Keep the graph up to date in the background, and serve it to
+                            later invocations in the same repository.
     -l, --local             Only display information available from the local git repo.
                             Continuous integration results will not be fetched.
+    --format=<format>       Output format: text, json (an array of branch records) or ndjson
+                            (one record per line, written as each is ready) [default: text].
 """
-import logging, re, sys, traceback
+import calendar, heapq, json, logging, os, sys, traceback
 from collections import Counter, defaultdict
 from datetime import datetime
+from io import StringIO
 from docopt import docopt
-from .git import Branch, revparse
-from .layout import layout
-from .lazy import lazy, lazy_invalidation
-from .travis import TravisClient
+from .git import Branch, refSnapshot
+from .graph_daemon import query, serve
+from .graphcache import GraphCache
+from .layout import IncrementalLayout
+from .lazy import lazy, lazy_instrumentation, lazy_invalidation
+from .listener import KeyListener, cbreak
+from .profiling import Profiler, inPhase, phase
+from .screen import Screen
 from .utils import window_size
+from .viewport import Viewport
+from .width import StyledLine, textWidth, truncate
 
 STATUS_ICONS = {
   'yellow': '⌛',
@@ -31,104 +46,162 @@ STATUS_ICONS = {
   'red': '🔥',
 }
 
-def allChildren(branch):
-  allChildren = set()
-  todo = [branch]
-  while todo:
-    b = todo.pop()
-    for child in b.children:
-      if child not in allChildren:
-        todo.append(child)
-        allChildren.add(child)
-  return allChildren
+def modtimeKey(branch):
+  return branch.modtime or datetime.fromtimestamp(1)
 
 class BranchBlockers(object):
+  """Finds the branch that must be displayed before each remaining branch.
+
+  A branch is blocked by its most recently modified remaining descendant, which may in turn be
+  blocked, and so on. Each branch remembers its latest remaining descendant, and only
+  recomputes it, from its children, once that descendant is removed: removing any other
+  branch cannot change a maximum. Resolving every branch is then close to linearithmic,
+  even for deep stacks of branches.
+  """
   def __init__(self, branches):
     self._branches = set(branches)
-    self._blockers = {}
+    self._ranks = {b: i for i, b in enumerate(sorted(branches, key = modtimeKey))}
+    self._latest = {}  # branch -> latest remaining descendant, or None if there are none
 
   def keys(self):
     return self._branches
 
+  def rank(self, branch):
+    """The position of branch when all branches are ordered by modification time."""
+    return self._ranks[branch]
+
   def __len__(self):
     return len(self._branches)
 
   def __contains__(self, branch):
     return branch in self._branches
 
+  def _isKnown(self, branch):
+    latest = self._latest.get(branch, branch)
+    return latest is None or (latest is not branch and latest in self._branches)
+
+  def _latestDescendant(self, branch):
+    """Returns branch's most recently modified remaining descendant, or None."""
+    stack = [branch]
+    expanding = set()  # Branches whose children are on the stack above them
+    while stack:
+      b = stack[-1]
+      if self._isKnown(b):
+        stack.pop()
+      elif b not in expanding:
+        expanding.add(b)
+        stack.extend(c for c in b.children if c not in expanding and not self._isKnown(c))
+      else:
+        latest = None
+        for c in b.children:
+          for candidate in (c, self._latest.get(c)):
+            if (candidate in self._branches and candidate is not b
+                and (latest is None or self._ranks[candidate] > self._ranks[latest])):
+              latest = candidate
+        self._latest[b] = latest
+        expanding.discard(b)
+        stack.pop()
+    return self._latest[branch]
+
   def __getitem__(self, branch):
     if not branch in self._branches:
       raise KeyError(branch)
-    if not branch.children:
-      return branch
-    children = self._blockers.get(branch)
-    if children is None:
-      self._blockers[branch] = children = list(allChildren(branch))
-      children.sort(key = lambda b : b.modtime)
-    while children and children[-1] not in self._branches:
-      children.pop()
-    return self[children[-1]] if children else branch
+    seen = set()
+    while True:
+      seen.add(branch)
+      latest = self._latestDescendant(branch)
+      if latest is None or latest in seen:
+        # Branches that have merged each other are descendants of each other; stop at the
+        # first one found again
+        return branch
+      branch = latest
 
   def __delitem__(self, branch):
     self._branches.remove(branch)
-    if branch in self._blockers:
-      del self._blockers[branch]
 
 class PriorityBranchIterator(object):
+  """Yields branches so that each is displayed after all the branches blocking it.
+
+  The most recently modified branch goes first, followed by the parents of each branch
+  displayed, depth first, before returning to the next most recent branch. Removed branches
+  are dropped lazily as they surface, so each step costs O(log n) amortized.
+  """
   def __init__(self, blockers):
     self._blockers = blockers
-    self._queue = list(blockers.keys())
-    self._queue.sort(key = lambda b: b.modtime)
+    self._queue = [(-blockers.rank(b), b) for b in blockers.keys()]
+    heapq.heapify(self._queue)
     self._priorities = []
+    self._prioritized = set()
 
   def __iter__(self):
     return self
 
   def __next__(self):
-    blocker = None
     while self._priorities and self._priorities[-1] not in self._blockers:
-      self._priorities.pop()
-    while self._queue and self._queue[-1] not in self._blockers:
-      self._queue.pop()
+      self._prioritized.discard(self._priorities.pop())
+    while self._queue and self._queue[0][1] not in self._blockers:
+      heapq.heappop(self._queue)
     if self._priorities:
       blocker = self._blockers[self._priorities[-1]]
     elif self._queue:
-      blocker = self._blockers[self._queue[-1]]
+      blocker = self._blockers[self._queue[0][1]]
     else:
       raise StopIteration()
     assert blocker in self._blockers
-    self._priorities.extend(p for p in blocker.parents
-                            if p in self._blockers and p not in self._priorities)
+    parents = [p for p in blocker.parents if p in self._blockers and p not in self._prioritized]
+    parents.sort(key = self._blockers.rank)
+    self._priorities.extend(parents)
+    self._prioritized.update(parents)
     del self._blockers[blocker]
     return blocker
 
+# Kept between evaluations of layoutAllBranches, so unchanged rows are reused when refs move
+LAYOUT = IncrementalLayout()
+
 @lazy
 def layoutAllBranches():
-  localBranches = Branch.ALL
-  relevantBranches = set(localBranches)
-  # Merge in any remote branches that are upstream of a local branch of a different name
-  for branch in localBranches:
-    if branch.upstream is not None and branch.upstream not in localBranches:
-      if branch.upstream.name.split('/', 1)[-1] != branch.name:
-        relevantBranches.add(branch.upstream)
-  branches = sorted(relevantBranches, key = lambda b : b.modtime or datetime.fromtimestamp(1))
-  branches = tuple(PriorityBranchIterator(BranchBlockers(branches)))
-  return list(zip(branches, layout(branches)))
-
-ESCAPE = re.compile(r'\x1b[\[][^@-~]*[@-~]')
-def stripEscapeCodes(s):
-  return ESCAPE.sub('', s)
-
-SURROGATE_PAIR = re.compile('[\ud800-\udbff][\udc00-\udfff]', re.UNICODE)
-# \U0001f538 - Small orange diamond
-# \U0001f539 - Small blue diamond
-DOUBLE_WIDTH = re.compile('[\u1b00-\u1bff\U0001f538\U0001f539]|[\u3dd8][\udc00-\udfff]', re.UNICODE)
-def displayLen(s):
-  return len(SURROGATE_PAIR.sub('.', DOUBLE_WIDTH.sub('..', s)))
-
-def printGraph(clearScreen = False, ciTools = ()):
-  remotes = frozenset(b.name for b in Branch.REMOTES)
-  remoteHashes = dict(list(zip(remotes, revparse(*remotes).splitlines())))
+  with phase('refs'):
+    localBranches = Branch.ALL
+    relevantBranches = set(localBranches)
+    # Merge in any remote branches that are upstream of a local branch of a different name
+    for branch in localBranches:
+      if branch.upstream is not None and branch.upstream not in localBranches:
+        if branch.upstream.name.split('/', 1)[-1] != branch.name:
+          relevantBranches.add(branch.upstream)
+  with phase('history'):
+    # Load every branch's history and upstream reflog in parallel, rather than one by one
+    Branch.prefetch(relevantBranches)
+  with phase('layout'):
+    branches = sorted(relevantBranches, key = modtimeKey)
+    branches = tuple(PriorityBranchIterator(BranchBlockers(branches)))
+    return list(zip(branches, LAYOUT.layout(branches)))
+
+class TerminalBuffer(StringIO):
+  """An in-memory output stream that can claim to be a terminal."""
+  def __init__(self, isatty = False):
+    StringIO.__init__(self)
+    self._isatty = isatty
+
+  def isatty(self):
+    return self._isatty
+
+# Kept between frames in --watch mode, so only lines that changed are redrawn
+SCREEN = Screen()
+
+@inPhase('render')
+def printGraph(clearScreen = False, ciTools = (), out = None, columns = None, screen = None,
+               viewport = None):
+  """Prints the graph to out, or stdout.
+
+  With clearScreen, the graph is drawn over the last one drawn to screen (SCREEN by default),
+  rewriting only the lines that changed. With a viewport, only as many rows as fit on the
+  terminal are shown, and CI statuses, unmerged counts and so on are only looked up for those.
+  """
+  out = out or sys.stdout
+  isatty = out.isatty()
+  with phase('refs'):
+    refs = refSnapshot()
+    remotes = frozenset(b.name for b in Branch.REMOTES)
   localsWithRemotes = defaultdict(set)
   for r in remotes:
     localsWithRemotes[r.split('/', 1)[-1]].add(r)
@@ -137,97 +210,179 @@ def printGraph(clearScreen = False, ciTools = ()):
   awaitingParents = []
   firstChilds = []
 
-  if clearScreen:
-    sys.stdout.write('\x1b[0;0H')
-
-  if sys.stdout.isatty():
-    def control(chars):
-      sys.stdout.write(chars)
-  else:
-    def control(chars):
-      pass
-
-  if sys.stdout.isatty():
-    rows, columns = window_size()
-
-  for b, row in layoutAllBranches():
-    graph = str(row) + '  '
-    name = b.name
-    remotes = ''
+  lines = []
+  size = None
+  if isatty and columns is None:
+    size = window_size()
+    rows, columns = size
+
+  branchRows = layoutAllBranches()
+  visible = range(len(branchRows))
+  if viewport is not None and size is not None:
+    # Leave a line for the scroll position, and one for the cursor
+    visible = viewport.visible(len(branchRows), size.rows - 2)
+
+  for b, row in branchRows[visible.start:visible.stop]:
+    line = StyledLine()
+    line.set('graph', str(row) + '  ')
+    line.set('name', b.name, '1;35' if b == Branch.HEAD else None)
     if b.name in localsWithRemotes:
-      version = b.allCommits[0].hash
-      if any(remoteHashes[r] != version for r in localsWithRemotes[b.name]):
-        remotes = ' 🔶'
+      version = refs.hash(b.name)
+      if any(refs.hash(r) != version for r in localsWithRemotes[b.name]):
+        line.set('remotes', ' 🔶')
       else:
-        remotes = ' 🔷'
-    ciStatus = ''
-    ciStatuses = [ status for tool in ciTools for status in list(tool.ciStatus(b).values()) if status ]
-    if ciStatuses:
-      ciStatus = ' ' + ''.join(STATUS_ICONS[status] for status in ciStatuses)
-    unmerged = ''
-    if b.unmerged > 0:
-      unmerged = ' \x1b[1;31m'
-      if b.unmerged <= 20:
-        unmerged += '%s unmerged' % chr(0x245F + b.unmerged)
+        line.set('remotes', ' 🔷')
+    with phase('ci'):
+      ciStatuses = [ status for tool in ciTools for status in list(tool.ciStatus(b).values()) if status ]
+    line.set('ci', ' ' + ''.join(STATUS_ICONS[status] for status in ciStatuses) if ciStatuses else '')
+    with phase('history'):
+      unmerged = b.unmerged
+    if unmerged > 0:
+      if unmerged <= 20:
+        line.set('unmerged', ' %s unmerged' % chr(0x245F + unmerged), '1;31')
       else:
-        unmerged += ' [%d unmerged]' % b.unmerged
-      unmerged += '\x1b[0m'
-
-    if sys.stdout.isatty():
-      line = graph + name + remotes + ciStatus + unmerged
+        line.set('unmerged', '  [%d unmerged]' % unmerged, '1;31')
 
+    if isatty:
       # Shorten the CI statuses if the line is too long
-      if displayLen(stripEscapeCodes(line)) > columns and ciStatuses:
+      if line.width > columns and ciStatuses:
         altCiStatus = ' '
         for status, count in Counter(ciStatuses).items():
           altCiStatus += STATUS_ICONS[status]
           if count > 1:
             altCiStatus += '×%d' % count
-        if displayLen(altCiStatus) < displayLen(ciStatus):
-          ciStatus = altCiStatus
-        line = graph + name + remotes + ciStatus + unmerged
+        if textWidth(altCiStatus) < line.segmentWidth('ci'):
+          line.set('ci', altCiStatus)
 
       # Remove the "unmerged" text if the line is too long
-      if displayLen(stripEscapeCodes(line)) > columns and b.unmerged > 0:
-        unmerged = ' \x1b[1;31m'
-        if b.unmerged <= 20:
-          unmerged += '%s ' % chr(0x245F + b.unmerged)
+      if line.width > columns and unmerged > 0:
+        if unmerged <= 20:
+          line.set('unmerged', ' %s ' % chr(0x245F + unmerged), '1;31')
         else:
-          unmerged += '[%d]' % b.unmerged
-        unmerged += '\x1b[0m'
-        line = graph + name + remotes + ciStatus + unmerged
+          line.set('unmerged', ' [%d]' % unmerged, '1;31')
 
       # Remove the space at the start of the CI statuses if the line is too long
-      if displayLen(stripEscapeCodes(line)) > columns:
-        ciStatus = ciStatus[1:]
-        line = graph + name + remotes + ciStatus + unmerged
+      if line.width > columns:
+        line.set('ci', line['ci'][1:])
 
       # Reduce the branch name down to 10 characters if the line is too long
-      if displayLen(stripEscapeCodes(line)) > columns and len(name) > 10:
-        space = max(10, columns + len(name) - displayLen(stripEscapeCodes(line)))
+      if line.width > columns and line.segmentWidth('name') > 10:
+        space = max(10, columns - line.width + line.segmentWidth('name'))
         name = b.name
         if '/' in name:
           dir, name = name.rsplit('/', 1)
-          name = dir[:max(0,space - 2 - len(name))] + '…/' + name
-        if len(name) > space:
-          name = name[:space - 1] + '…'
-        line = graph + name + remotes + ciStatus + unmerged
+          name = truncate(dir, max(0, space - 2 - textWidth(name)), '') + '…/' + name
+        line.set('name', truncate(name, space), '1;35' if b == Branch.HEAD else None)
 
-    if b == Branch.HEAD:
-      name = '\x1b[1;35m' + name + '\x1b[0m'
-    line = graph + name + remotes + ciStatus + unmerged
+    lines.append(line.render(styled = isatty))
 
-    if not sys.stdout.isatty():
-      line = stripEscapeCodes(line)
-    sys.stdout.write(line)
-
-    if clearScreen:
-      control('\x1b[K')
-    sys.stdout.write('\n')
+  if len(visible) < len(branchRows):
+    status = '── %d-%d of %d (j/k, space/b to scroll) ' % (
+        visible.start + 1, visible.stop, len(branchRows))
+    line = StyledLine()
+    line.set('status', status + '─' * max(0, columns - textWidth(status)), '2')
+    lines.append(line.render())
 
   if clearScreen:
-    control('\x1b[J')
-    sys.stdout.flush()
+    (screen or SCREEN).draw(out, lines, size)
+  else:
+    out.write(''.join(line + '\n' for line in lines))
+
+def graphRecords(ciTools = ()):
+  """Yields a JSON-compatible record describing each branch in the graph, in display order."""
+  refs = refSnapshot()
+  remotes = defaultdict(set)
+  for r in Branch.REMOTES:
+    remotes[r.name.split('/', 1)[-1]].add(r.name)
+  for b, row in layoutAllBranches():
+    if b.name in remotes:
+      version = refs.hash(b.name)
+      inSync = all(refs.hash(r) == version for r in remotes[b.name])
+    else:
+      inSync = None
+    yield {
+      'name': b.name,
+      'head': b == Branch.HEAD,
+      'graph': str(row),
+      'row': {'at': row.at, 'up': sorted(row.up), 'down': sorted(row.down),
+              'through': sorted(row.through)},
+      'remotes': sorted(remotes.get(b.name, ())),
+      'inSync': inSync,
+      'ci': {remote: status for tool in ciTools
+             for remote, status in tool.ciStatus(b).items() if status},
+      'unmerged': b.unmerged,
+      'modtime': b.modtime and calendar.timegm(b.modtime.utctimetuple()),
+    }
+
+def printRecords(format, ciTools = (), out = None):
+  """Writes graphRecords to out, or stdout, as a JSON array or as newline-delimited JSON.
+
+  Each record is written and flushed as soon as it is ready, so consumers can start on the
+  first branches before the rest have been looked up.
+  """
+  out = out or sys.stdout
+  separator = '[\n' if format == 'json' else ''
+  for record in graphRecords(ciTools):
+    out.write(separator + json.dumps(record, ensure_ascii = False))
+    if format == 'ndjson':
+      out.write('\n')
+    else:
+      separator = ',\n'
+    out.flush()
+  if format == 'json':
+    out.write('[]\n' if separator == '[\n' else '\n]\n')
+
+def printCachedGraph(printer = printGraph, **printGraphArgs):
+  """Prints the graph, reusing the layout from the last run if no refs have changed since."""
+  cache = GraphCache()
+  if cache.load():
+    layoutAllBranches.prime(cache.prime())
+    printer(**printGraphArgs)
+  else:
+    printer(**printGraphArgs)
+    cache.save(layoutAllBranches())
+
+def profileGraph(tracePath = None, **printGraphArgs):
+  """Prints the graph, then where the time went to stderr, optionally saving a trace too."""
+  with Profiler() as profiler, lazy_instrumentation() as instrumentation:
+    printGraph(**printGraphArgs)
+  sys.stderr.write('\n' + profiler.summary() + '\n' + instrumentation.profile())
+  if tracePath:
+    with open(tracePath, 'w') as f:
+      json.dump(profiler.chromeTrace(), f)
+
+def daemonRenderer(ciTools = ()):
+  """Returns a function rendering the graph as each client request asks.
+
+  A daemon started with --local has no CI clients, so it refuses requests for CI statuses
+  rather than answering them with local-only output; those clients render in-process instead.
+  """
+  def render(request):
+    if not request.get('local') and not ciTools:
+      raise ValueError('This daemon only serves --local requests')
+    out = TerminalBuffer(isatty = request.get('tty', False))
+    printGraph(ciTools = () if request.get('local') else ciTools,
+               out = out, columns = request.get('columns'))
+    return out.getvalue()
+  return render
+
+def runDaemon(ciTools = ()):
+  """Serves the graph to git-graph-branch clients until interrupted."""
+  try:
+    serve(daemonRenderer(ciTools), warm = layoutAllBranches)
+  except KeyboardInterrupt:
+    pass
+
+def queryDaemon(options):
+  """Returns the graph as rendered by a running daemon, or None if there is none."""
+  isatty = sys.stdout.isatty()
+  columns = None
+  if isatty:
+    try:
+      columns = os.get_terminal_size(sys.stdout.fileno()).columns
+    except OSError:
+      return None
+  return query(tty = isatty, columns = columns, local = bool(options['--local']))
 
 def getPrintGraphArgs(options):
   def select(name, **algorithms):
@@ -236,35 +391,51 @@ def getPrintGraphArgs(options):
     except KeyError:
       sys.stderr.write('%s not a valid choice for %s (must be one of: %s)'
                        % (options[name], name, ", ".join(list(algorithms.keys()))))
-  return {
-    'ciTools' : () if options['--local'] else (TravisClient(),)
-  }
+  if options['--local']:
+    return {'ciTools': ()}
+  from .travis import TravisClient  # Slow to import, and only needed for CI statuses
+  return {'ciTools': (TravisClient(),)}
 
 def main():
   logging.basicConfig()
   options = docopt(__doc__)
+  format = options['--format']
+  if format not in ('text', 'json', 'ndjson'):
+    sys.stderr.write('%s not a valid choice for --format (must be one of: text, json, ndjson)\n'
+                     % format)
+    sys.exit(2)
   if options['--watch']:
     assert sys.stdout.isatty()
   printGraphArgs = getPrintGraphArgs(options)
-  if options['--watch']:
+  if format != 'text':
+    printCachedGraph(printer = printRecords, format = format, **printGraphArgs)
+  elif options['--watch']:
+    keys = KeyListener(sys.stdin.fileno()) if sys.stdin.isatty() else None
+    viewport = Viewport(keys)
     try:
       @lazy
       def action():
         try:
-          printGraph(clearScreen = True, **printGraphArgs)
+          printGraph(clearScreen = True, viewport = viewport, **printGraphArgs)
         except Exception:
           sys.stdout.write('\n')
           sys.stdout.flush()
           traceback.print_exc(3)
           sys.stdout.write('\x1b[J')
           sys.stdout.flush()
-      with lazy_invalidation():
+          SCREEN.reset()
+      with cbreak(sys.stdin), lazy_invalidation():
         action.continually()
     except KeyboardInterrupt:
       pass
-  elif options['--profile']:
-    import cProfile
-    cProfile.run('printGraph(**printGraphArgs)')
+  elif options['--profile'] or options['--trace']:
+    profileGraph(options['--trace'], **printGraphArgs)
+  elif options['--daemon']:
+    runDaemon(**printGraphArgs)
   else:
-    printGraph(**printGraphArgs)
+    output = queryDaemon(options)
+    if output is not None:
+      sys.stdout.write(output)
+    else:
+      printCachedGraph(**printGraphArgs)
 
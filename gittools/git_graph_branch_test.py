@@ -0,0 +1,192 @@
+import json, random, time
+import pytest
+from datetime import datetime, timedelta
+from . import git_graph_branch
+from .git import Branch
+from .git_graph_branch import (BranchBlockers, PriorityBranchIterator, TerminalBuffer,
+                               daemonRenderer, printGraph, printRecords)
+from .testing import git
+from .utils import ShAccounting, WindowSize
+from .viewport import Viewport
+
+class FakeBranch(object):
+  def __init__(self, name, modtime):
+    self.name = name
+    self.modtime = modtime
+    self.parents = []
+    self.children = []
+
+  def __repr__(self):
+    return self.name
+
+def branches(count, parentsOf, shuffle = False):
+  """Makes count branches, modified in order, with the given parent indices."""
+  start = datetime(2020, 1, 1)
+  result = [FakeBranch('b%d' % i, start + timedelta(minutes = i)) for i in range(count)]
+  for i, b in enumerate(result):
+    for p in parentsOf(i):
+      b.parents.append(result[p])
+      result[p].children.append(b)
+  if shuffle:
+    random.shuffle(result)
+  return result
+
+def order(branches):
+  return list(PriorityBranchIterator(BranchBlockers(branches)))
+
+def referenceOrder(branches):
+  """The original quadratic ordering, for comparison."""
+  remaining = set(branches)
+  byModtime = sorted(branches, key = lambda b: b.modtime)
+  def descendants(branch):
+    found, todo = set(), [branch]
+    while todo:
+      for child in todo.pop().children:
+        if child not in found:
+          found.add(child)
+          todo.append(child)
+    return found
+  def blocker(branch):
+    children = sorted((c for c in descendants(branch) if c in remaining),
+                      key = lambda b: b.modtime)
+    return blocker(children[-1]) if children else branch
+  result, priorities = [], []
+  while remaining:
+    while priorities and priorities[-1] not in remaining:
+      priorities.pop()
+    while byModtime[-1] not in remaining:
+      byModtime.pop()
+    b = blocker(priorities[-1] if priorities else byModtime[-1])
+    parents = sorted((p for p in b.parents if p in remaining and p not in priorities),
+                     key = lambda b: b.modtime)
+    priorities.extend(parents)
+    remaining.remove(b)
+    result.append(b)
+  return result
+
+def assertParentsLast(ordered):
+  position = {b: i for i, b in enumerate(ordered)}
+  for b in ordered:
+    for p in b.parents:
+      assert position[p] > position[b]
+
+def test_order_matches_reference():
+  rng = random.Random(0)
+  for _ in range(200):
+    count = rng.randint(1, 30)
+    def parentsOf(i):
+      return rng.sample(range(i), min(i, rng.choice([0, 1, 1, 1, 2, 3])))
+    bs = branches(count, parentsOf, shuffle = True)
+    assert order(bs) == referenceOrder(bs)
+
+def test_children_before_parents():
+  bs = branches(500, lambda i: [i - 1] if i % 7 else [])
+  ordered = order(bs)
+  assert sorted(ordered, key = lambda b: b.name) == sorted(bs, key = lambda b: b.name)
+  assertParentsLast(ordered)
+
+def test_branches_that_merged_each_other():
+  # Each branch is the other's parent, and so each other's descendant
+  bs = branches(3, lambda i: [i + 1] if i < 2 else [0])
+  ordered = order(bs)
+  assert sorted(ordered, key = lambda b: b.name) == sorted(bs, key = lambda b: b.name)
+
+def timed(bs):
+  start = time.perf_counter()
+  ordered = order(bs)
+  elapsed = time.perf_counter() - start
+  assert len(ordered) == len(bs)
+  return elapsed
+
+@pytest.mark.benchmark
+def test_benchmark_10k_deep_stack():
+  # Each branch is based on the last; the original algorithm was quadratic here
+  elapsed = timed(branches(10000, lambda i: [i - 1] if i else []))
+  assert elapsed < 2.0
+
+@pytest.mark.benchmark
+def test_benchmark_10k_deep_stack_oldest_last():
+  # Parents modified after their children force blockers to be resolved down the stack
+  elapsed = timed(branches(10000, lambda i: [i + 1] if i < 9999 else []))
+  assert elapsed < 2.0
+
+@pytest.mark.benchmark
+def test_benchmark_10k_random_forest():
+  rng = random.Random(1)
+  bs = branches(10000, lambda i: rng.sample(range(max(0, i - 50), i), min(i, rng.choice([1, 1, 2]))))
+  elapsed = timed(bs)
+  assert elapsed < 2.0
+
+def test_viewport_only_formats_visible_rows(repo, monkeypatch):
+  git(repo, 'init', '-q', '-b', 'viewport-main')
+  git(repo, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  for i in range(10):
+    git(repo, 'branch', '--track', 'viewport-%d' % i, 'viewport-main')
+  monkeypatch.setattr(git_graph_branch, 'window_size', lambda: WindowSize(6, 80))
+  out = TerminalBuffer(isatty = True)
+  printGraph(out = out, viewport = Viewport())
+  lines = out.getvalue().splitlines()
+  assert len(lines) == 5
+  assert '1-4 of 11' in lines[-1]
+  shown = [b for b, _ in git_graph_branch.layoutAllBranches()[:4]]
+  hidden = [b for b, _ in git_graph_branch.layoutAllBranches()[4:]]
+  assert all(Branch.unmerged.is_cached(b) for b in shown)
+  assert not any(Branch.unmerged.is_cached(b) for b in hidden)
+
+def test_cyclic_upstreams(repo):
+  git(repo, 'init', '-q', '-b', 'cyclic-main')
+  git(repo, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  for name, upstream in [('cyclic-a', 'cyclic-main'), ('cyclic-b', 'cyclic-a')]:
+    git(repo, 'checkout', '-q', '-b', name, '--track', upstream)
+    git(repo, 'commit', '-q', '--allow-empty', '-m', name)
+  git(repo, 'branch', '-q', '--set-upstream-to', 'cyclic-b', 'cyclic-a')
+  out = TerminalBuffer()
+  printGraph(out = out)
+  for name in ('cyclic-main', 'cyclic-a', 'cyclic-b'):
+    assert name in out.getvalue()
+
+def test_local_daemon_refuses_requests_for_ci(repo):
+  git(repo, 'init', '-q', '-b', 'daemon-main')
+  git(repo, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  render = daemonRenderer(ciTools = ())
+  assert 'daemon-main' in render({'local': True})
+  with pytest.raises(ValueError):
+    render({'local': False})
+
+class FlushCountingBuffer(TerminalBuffer):
+  flushes = 0
+
+  def flush(self):
+    self.flushes += 1
+
+def test_print_records(monkeypatch):
+  records = [{'name': 'a', 'graph': '┬'}, {'name': 'b', 'graph': '┴'}]
+  monkeypatch.setattr(git_graph_branch, 'graphRecords', lambda ciTools: iter(records))
+  out = FlushCountingBuffer()
+  printRecords('ndjson', out = out)
+  assert [json.loads(l) for l in out.getvalue().splitlines()] == records
+  assert out.flushes == 2
+  out = FlushCountingBuffer()
+  printRecords('json', out = out)
+  assert json.loads(out.getvalue()) == records
+  monkeypatch.setattr(git_graph_branch, 'graphRecords', lambda ciTools: iter(()))
+  out = FlushCountingBuffer()
+  printRecords('json', out = out)
+  assert json.loads(out.getvalue()) == []
+
+# Refs come from a single for-each-ref and commits from one shared `git log` stream, counted
+# although it is never read to the end, leaving one reflog read per distinct upstream: here,
+# just budget-main's
+RENDER_PROCESS_BUDGET = 5
+
+def test_render_process_budget(repo):
+  git(repo, 'init', '-q', '-b', 'budget-main')
+  git(repo, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  for i in range(10):
+    git(repo, 'checkout', '-q', '-b', 'budget-%d' % i, '--track', 'budget-main')
+    git(repo, 'commit', '-q', '--allow-empty', '-m', 'Branch %d' % i)
+  git(repo, 'checkout', '-q', 'budget-main')
+  git(repo, 'commit-graph', 'write', '--reachable')
+  with ShAccounting() as accounting:
+    printGraph(out = TerminalBuffer())
+  assert len(accounting) <= RENDER_PROCESS_BUDGET, accounting.summary()
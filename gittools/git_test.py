@@ -1,4 +1,5 @@
 from . import git
+from .testing import forgetLazyResults, git as run
 
 def test_mergedBranches_single_branch():
   assert frozenset(['Foo']) == git.Branch._mergedBranches("Merge branch 'Foo' into master")
@@ -7,3 +8,158 @@ def test_mergedBranches_five_branches():
   assert frozenset("ABCDE") == git.Branch._mergedBranches(
       "Merge branches 'A', 'B', 'C', 'D' and 'E' into master")
 
+
+def commits(*hashes):
+  return [git.Commit(h, 'Commit ' + h, []) for h in hashes]
+
+def reflog(*hashes):
+  return [git.RefLine(i, h) for i, h in enumerate(hashes)]
+
+class CountingList(list):
+  """A list that records how far it has been iterated."""
+  consumed = 0
+
+  def __iter__(self):
+    for i, v in enumerate(list.__iter__(self)):
+      self.consumed = i + 1
+      yield v
+
+def test_forkPoint_shared_history():
+  history = commits('f2', 'f1', 'm1', 'm0')
+  upstream = commits('m3', 'm2', 'm1', 'm0')
+  assert git.forkPoint(history, upstream) == history[2]
+
+def test_forkPoint_no_shared_history():
+  assert git.forkPoint(commits('f1', 'f0'), commits('m1', 'm0')) is None
+
+def test_forkPoint_rebased_upstream():
+  # Upstream used to point at o1, but was rebased, leaving o1 only on our branch
+  history = commits('f1', 'o1', 'o0', 'm0')
+  upstream = commits('n1', 'n0', 'm0')
+  assert git.forkPoint(history, upstream, reflog('n1', 'o1')) == history[1]
+
+def test_forkPoint_reflog_on_shared_history_wins():
+  history = commits('f1', 'o1', 'm1', 'm0')
+  upstream = commits('m2', 'm1', 'm0')
+  assert git.forkPoint(history, upstream, reflog('m2', 'm0', 'o1')) == history[2]
+
+def test_forkPoint_walks_only_to_fork():
+  history = CountingList(commits('f1', 'm1', *('old%d' % i for i in range(1000))))
+  upstream = CountingList(commits('m2', 'm1', *('old%d' % i for i in range(1000))))
+  assert git.forkPoint(history, upstream, reflog('m2', 'm1')) == history[1]
+  assert history.consumed <= 3
+  assert upstream.consumed <= 3
+
+def test_forkPoint_matches_full_history_sets():
+  import random
+  rng = random.Random(0)
+  for _ in range(500):
+    base = ['b%d' % i for i in range(rng.randrange(4))]
+    history = commits(*(['h%d' % i for i in range(rng.randrange(4))] + base))
+    upstream = commits(*(['u%d' % i for i in range(rng.randrange(4))] + base))
+    allHashes = [c.hash for c in history + upstream] + ['x']
+    log = reflog(*(rng.choice(allHashes) for _ in range(rng.randrange(4))))
+    # The original implementation, which built sets of both entire histories
+    commitHashes = set(c.hash for c in history)
+    firstUpstreamReference = next((h.hash for h in log if h.hash in commitHashes), None)
+    upstreamCommitHashes = set(c.hash for c in upstream)
+    expected = next((c for c in history if c.hash in upstreamCommitHashes
+                     or c.hash == firstUpstreamReference), None)
+    assert git.forkPoint(history, upstream, log) == expected, (history, upstream, log)
+
+def test_HistorySet_stops_below_generation():
+  generations = {'h%d' % i: 100 - i for i in range(100)}
+  history = CountingList(commits(*('h%d' % i for i in range(100))))
+  historySet = git.HistorySet([history], generations.get)
+  assert 'h10' in historySet
+  assert history.consumed == 11
+  generations['x'] = 80
+  assert 'x' not in historySet
+  assert history.consumed == 22
+
+def test_HistorySet_without_generations():
+  history = CountingList(commits('a', 'b', 'c'))
+  historySet = git.HistorySet([history, commits('d')])
+  assert 'd' in historySet
+  assert 'x' not in historySet
+  assert history.consumed == 3
+
+def test_prefetch_primes_upstream_reflogs(repo):
+  run(repo, 'init', '-q', '-b', 'prefetch-main')
+  run(repo, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  run(repo, 'commit', '-q', '--allow-empty', '-m', 'Second')
+  run(repo, 'checkout', '-q', '-b', 'prefetch-other', '--track', 'prefetch-main')
+  run(repo, 'commit', '-q', '--allow-empty', '-m', 'Other')
+  main, other = git.Branch('prefetch-main'), git.Branch('prefetch-other')
+  git.Branch.prefetch([other])
+  assert git.Branch._refLog.is_cached(main)
+  assert not git.Branch._refLog.is_cached(other)
+  assert [h for _, h in main._refLog] == [run(repo, 'rev-parse', 'prefetch-main'),
+                                          run(repo, 'rev-parse', 'prefetch-main~')]
+  git.Branch.prefetch([other])  # Already-cached values are left alone
+
+def test_children(repo):
+  run(repo, 'init', '-q', '-b', 'children-main')
+  run(repo, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  for name in ('children-a', 'children-b'):
+    run(repo, 'branch', '--track', name, 'children-main')
+  run(repo, 'branch', '--track', 'children-c', 'children-a')
+  main, a, b, c = (git.Branch('children-' + n) for n in ('main', 'a', 'b', 'c'))
+  assert main.children == {a, b}
+  assert a.children == {c}
+  assert c.children == frozenset()
+
+def test_unmerged_matches_rev_list(repo):
+  run(repo, 'init', '-q', '-b', 'unmerged-main')
+  run(repo, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  run(repo, 'checkout', '-q', '-b', 'unmerged-topic')
+  run(repo, 'commit', '-q', '--allow-empty', '-m', 'Topic')
+  run(repo, 'checkout', '-q', '-b', 'unmerged-feature', '--track', 'unmerged-main')
+  run(repo, 'commit', '-q', '--allow-empty', '-m', 'Feature')
+  feature = git.Branch('unmerged-feature')
+
+  def check():
+    # unmerged is worked out incrementally from the last count, then again from scratch
+    parents = [p.name for p in feature.parents if p.name in git.refSnapshot().branches]
+    expected = int(run(repo, 'rev-list', '--count', '^unmerged-feature', *parents))
+    assert feature.unmerged == expected
+    forgetLazyResults()
+    feature._unmergedState = None
+    assert feature.unmerged == expected
+    return expected
+
+  def step(*commands):
+    for command in commands:
+      run(repo, *command)
+    forgetLazyResults()
+    return check()
+
+  check()
+  assert step(('checkout', '-q', 'unmerged-main'),
+              ('commit', '-q', '--allow-empty', '-m', 'Main 1'),
+              ('commit', '-q', '--allow-empty', '-m', 'Main 2')) == 2  # Fast-forward
+  assert step(('checkout', '-q', 'unmerged-feature'),
+              ('commit', '-q', '--allow-empty', '-m', 'Feature 2')) == 2
+  # Merged branches become parents too, and their merges are then followed
+  assert step(('merge', '-q', '--no-edit', 'unmerged-topic')) == 2
+  assert step(('merge', '-q', '--no-edit', 'unmerged-main')) == 0
+  assert step(('checkout', '-q', 'unmerged-main'),
+              ('commit', '-q', '--allow-empty', '-m', 'Main 3')) == 1
+  assert step(('checkout', '-q', 'unmerged-topic'),
+              ('commit', '-q', '--allow-empty', '-m', 'Topic 2')) == 2
+  # Rebase, then force-push, the upstream
+  assert step(('checkout', '-q', 'unmerged-main'),
+              ('reset', '-q', '--hard', 'unmerged-main~2'),
+              ('commit', '-q', '--allow-empty', '-m', 'Main 2, rewritten')) == 2
+  assert step(('branch', '-q', '-D', 'unmerged-topic')) == 1
+
+def test_refStore_from_a_subdirectory(repo, monkeypatch):
+  run(repo, 'init', '-q', '-b', 'subdir-main')
+  run(repo, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  (repo / 'sub').mkdir()
+  gitDir = str(repo / '.git')
+  assert git.refStore().gitDir == gitDir
+  monkeypatch.chdir(repo / 'sub')
+  store = git.refStore()
+  assert store.gitDir == store.commonDir == gitDir
+  assert git.revparse('--git-dir') == run(repo / 'sub', 'rev-parse', '--absolute-git-dir')
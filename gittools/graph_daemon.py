@@ -0,0 +1,95 @@
+import json, os, select, socket
+from .lazy import flush_invalidations, lazy_invalidation, invalidation_event
+from .refs import findGitDir
+
+__all__ = ['query', 'serve', 'socketPath']
+
+SOCKET_NAME = 'graph-branch.sock'
+
+def socketPath(gitDir = None):
+  """Returns the path of the daemon's socket for the current repository, or None."""
+  gitDir = gitDir or findGitDir()
+  return gitDir and os.path.join(os.path.abspath(gitDir), SOCKET_NAME)
+
+def _readLine(sock):
+  chunks = []
+  while True:
+    chunk = sock.recv(65536)
+    if not chunk:
+      break
+    chunks.append(chunk)
+    if chunk.endswith(b'\n'):
+      break
+  return b''.join(chunks)
+
+def query(timeout = 5.0, **request):
+  """Asks a running daemon to render the graph, returning its output, or None if none answers.
+
+  Callers should fall back to rendering in-process when None is returned.
+  """
+  path = socketPath()
+  if path is None or not os.path.exists(path):
+    return None
+  try:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      sock.settimeout(timeout)
+      sock.connect(path)
+      sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+      response = json.loads(_readLine(sock).decode('utf-8'))
+    finally:
+      sock.close()
+  except (OSError, ValueError):
+    return None
+  return response.get('output')
+
+def _respond(conn, render):
+  try:
+    conn.settimeout(5.0)
+    request = json.loads(_readLine(conn).decode('utf-8'))
+    try:
+      response = {'output': render(request)}
+    except Exception as e:
+      response = {'error': '%s: %s' % (type(e).__name__, e)}
+    conn.sendall(json.dumps(response).encode('utf-8') + b'\n')
+  except (OSError, ValueError):
+    pass
+  finally:
+    conn.close()
+
+def serve(render, warm = None, pollInterval = 0.2):
+  """Serves render(request) -> str over the repository's socket until interrupted.
+
+  Runs on the main thread inside a lazy_invalidation context, so lazy results stay cached
+  between requests and are only recomputed when git changes them. If given, warm() is called
+  after each batch of changes so the next request finds the graph already computed.
+  """
+  path = socketPath()
+  if path is None:
+    raise ValueError('Not a git repository')
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    # Only publish the socket once it is accepting connections, replacing any stale one
+    tmpPath = '%s.%d' % (path, os.getpid())
+    server.bind(tmpPath)
+    server.listen(8)
+    os.replace(tmpPath, path)
+    with lazy_invalidation():
+      if warm is not None:
+        warm()
+      while True:
+        readable, _, _ = select.select([server], [], [], pollInterval)
+        if invalidation_event.is_set():
+          flush_invalidations()
+          if warm is not None:
+            warm()
+        if readable:
+          conn, _ = server.accept()
+          flush_invalidations()
+          _respond(conn, render)
+  finally:
+    server.close()
+    try:
+      os.unlink(path)
+    except OSError:
+      pass
@@ -0,0 +1,31 @@
+import _thread, os, subprocess, threading, time
+import pytest
+from .graph_daemon import query, serve, socketPath
+
+def init(tmp_path, monkeypatch):
+  subprocess.check_call(('git', 'init', '-q', str(tmp_path)))
+  monkeypatch.setenv('GIT_DIR', str(tmp_path / '.git'))
+
+def test_query_without_daemon(tmp_path, monkeypatch):
+  init(tmp_path, monkeypatch)
+  assert query(local = True) is None
+
+def test_serve_answers_queries(tmp_path, monkeypatch):
+  init(tmp_path, monkeypatch)
+  results = []
+  def client():
+    deadline = time.time() + 10
+    while not os.path.exists(socketPath()) and time.time() < deadline:
+      time.sleep(0.01)
+    results.append(query(columns = 80, local = True))
+    results.append(query(fail = True))
+    _thread.interrupt_main()
+  def render(request):
+    if request.get('fail'):
+      raise RuntimeError('Oops')
+    return 'graph %(columns)d\n' % request
+  threading.Thread(target = client).start()
+  with pytest.raises(KeyboardInterrupt):
+    serve(render)
+  assert results == ['graph 80\n', None]
+  assert not os.path.exists(socketPath())
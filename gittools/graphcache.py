@@ -0,0 +1,104 @@
+import calendar, hashlib, json, os
+from datetime import datetime
+from .git import refSnapshot, refStore, Branch, Commit
+from .layout import Row
+from .refs import Ref, RefSnapshot
+
+__all__ = ['GraphCache']
+
+class GraphCache(object):
+  """A cache of branch topology and layout, persisted under the git dir between runs.
+
+  The cache is keyed by every branch and remote tip, the repository config (for upstreams)
+  and the newest entry of each reflog (used by upstreamCommit), all read directly from disk,
+  so validating it spawns no processes. Cached values are primed into the lazy properties
+  they replace; since primed values have no dependencies, this is only suitable for one-shot
+  runs, not --watch.
+  """
+  VERSION = 1
+  FILENAME = 'graph-branch.cache'
+
+  def __init__(self, store = None):
+    self._store = store or refStore()
+    self.path = self._store and os.path.join(self._store.gitDir, GraphCache.FILENAME)
+    self._data = None
+
+  def _reflogTail(self, refname):
+    try:
+      with open(os.path.join(self._store.commonDir, 'logs', refname), 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 512))
+        lines = f.read().splitlines()
+      return '%d:%s' % (size, lines[-1].split(b' ', 2)[1].decode('ascii') if lines else '')
+    except (IOError, OSError, IndexError, UnicodeDecodeError):
+      return None
+
+  def key(self):
+    refs = self._store.refs('refs/heads/', 'refs/remotes/')
+    try:
+      with open(os.path.join(self._store.commonDir, 'config'), 'rb') as f:
+        config = hashlib.sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+      config = None
+    return {
+      'refs': refs,
+      'config': config,
+      'reflogs': {refname: self._reflogTail(refname) for refname in refs},
+    }
+
+  def load(self):
+    """Loads the cache, returning whether it is still valid for the repository."""
+    if self.path is None:
+      return False
+    try:
+      with open(self.path) as f:
+        data = json.load(f)
+    except (IOError, OSError, ValueError):
+      return False
+    if data.get('version') != GraphCache.VERSION or data.get('key') != self.key():
+      return False
+    self._data = data
+    return True
+
+  def prime(self):
+    """Primes the ref snapshot and Branch properties, returning the cached layout."""
+    data = self._data
+    refSnapshot.prime(RefSnapshot(Ref(*ref) for ref in data['refs']))
+    for name, values in data['branches'].items():
+      branch = Branch(name)
+      Branch.parents.prime(branch, frozenset(Branch(p) for p in values['parents']))
+      commit = values['upstreamCommit']
+      Branch.upstreamCommit.prime(branch, commit and Commit(*commit))
+      Branch.unmerged.prime(branch, values['unmerged'])
+      modtime = values['modtime']
+      Branch.modtime.prime(branch, None if modtime is None else datetime.utcfromtimestamp(modtime))
+    return [(Branch(name), Row(at, up = up, down = down, through = through))
+            for name, at, up, down, through in data['layout']]
+
+  def save(self, layout):
+    """Saves the layout, and the Branch properties it was computed from, for the next run."""
+    if self.path is None:
+      return
+    def timestamp(modtime):
+      return None if modtime is None else calendar.timegm(modtime.utctimetuple())
+    snapshot = refSnapshot()
+    data = {
+      'version': GraphCache.VERSION,
+      'key': self.key(),
+      'refs': [snapshot.get(name) for name in snapshot.branches + snapshot.remotes],
+      'branches': {b.name: {'parents': sorted(p.name for p in b.parents),
+                            'upstreamCommit': b.upstreamCommit,
+                            'unmerged': b.unmerged,
+                            'modtime': timestamp(b.modtime)}
+                   for b, _ in layout},
+      'layout': [(b.name, row.at, sorted(row.up), sorted(row.down), sorted(row.through))
+                 for b, row in layout],
+    }
+    tmp = self.path + '.tmp'
+    try:
+      with open(tmp, 'w') as f:
+        json.dump(data, f)
+      os.replace(tmp, self.path)
+    except (IOError, OSError):
+      pass
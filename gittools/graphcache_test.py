@@ -0,0 +1,29 @@
+from .graphcache import GraphCache
+from .refs import RefStore
+from .testing import git
+
+def test_key_tracks_refs_config_and_reflogs(tmp_path):
+  git(tmp_path, 'init', '-q', '-b', 'master')
+  git(tmp_path, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  git(tmp_path, 'branch', 'feature')
+  cache = GraphCache(RefStore(str(tmp_path / '.git')))
+  key = cache.key()
+  assert set(key['refs']) == {'refs/heads/master', 'refs/heads/feature'}
+  assert cache.key() == key
+
+  git(tmp_path, 'branch', '--set-upstream-to=master', 'feature')
+  assert cache.key()['config'] != key['config']
+  key = cache.key()
+
+  git(tmp_path, 'commit', '-q', '--allow-empty', '-m', 'Second')
+  assert cache.key()['refs'] != key['refs']
+  assert cache.key()['reflogs'] != key['reflogs']
+
+def test_load_rejects_stale_cache(tmp_path):
+  git(tmp_path, 'init', '-q', '-b', 'master')
+  git(tmp_path, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  cache = GraphCache(RefStore(str(tmp_path / '.git')))
+  assert not cache.load()
+  (tmp_path / '.git' / GraphCache.FILENAME).write_text(
+      '{"version": %d, "key": {}}' % GraphCache.VERSION)
+  assert not cache.load()
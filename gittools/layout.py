@@ -2,6 +2,23 @@
 from collections import namedtuple
 from .utils import first
 
+def _mask(columns):
+  """Returns a bitmask with the given column indices set."""
+  mask = 0
+  for column in columns:
+    assert column >= 0
+    mask |= 1 << column
+  return mask
+
+def _columns(mask):
+  """Returns the column indices set in a bitmask of columns."""
+  columns = []
+  while mask:
+    lowest = mask & -mask
+    columns.append(lowest.bit_length() - 1)
+    mask ^= lowest
+  return columns
+
 class Row(object):
   """Representation of a single row of a DAG.
 
@@ -12,67 +29,111 @@ class Row(object):
 
   repr(self): Pythonic representation of this row, e.g. Row(at = 1, up={0,1}, down={0})
   str(self): Unicode-art representation of this row, e.g. ├▶┘
+
+  Column sets are stored as bitmasks. Rendering is cached by shape, so redrawing a row that
+  has been drawn before, by this or any other Row object, costs a dictionary lookup.
   """
 
   BOX_CHARS = [ " ", "╵", "╶", "└", "╷", "│", "┌", "├",
                 "╴", "┘", "─", "┴", "┐", "┤", "┬", "┼" ]
+  RENDER_CACHE_SIZE = 4096
+
+  __slots__ = ('at', '_up', '_down', '_through')
+  _rendered = {}
 
   def __init__(self, at, up = (), down = (), through = ()):
+    assert 0 <= at
     self.at = at
-    self.up = frozenset(up)
-    self.down = frozenset(down)
-    self.through = frozenset(through)
-    self._min = min({self.at} | self.up | self.down)
-    self._max = max({self.at} | self.up | self.down)
-    self._cols = max({self._max} | self.through) + 1
-    assert 0 <= self.at
-    assert all(idx >= 0 for idx in self.up)
-    assert all(idx >= 0 for idx in self.down)
-    assert all(idx >= 0 for idx in self.through)
-    assert not any(idx in self.up or idx in self.down for idx in self.through)
+    self._up = _mask(up)
+    self._down = _mask(down)
+    self._through = _mask(through)
+    assert not self._through & (self._up | self._down)
+
+  @classmethod
+  def fromMasks(cls, at, up = 0, down = 0, through = 0):
+    """Creates a Row from bitmasks of columns, e.g. up = 0b101 for columns 0 and 2."""
+    row = cls.__new__(cls)
+    row.at = at
+    row._up = up
+    row._down = down
+    row._through = through
+    assert 0 <= at
+    assert not through & (up | down)
+    return row
+
+  @property
+  def up(self):
+    return frozenset(_columns(self._up))
+
+  @property
+  def down(self):
+    return frozenset(_columns(self._down))
+
+  @property
+  def through(self):
+    return frozenset(_columns(self._through))
+
+  def _key(self):
+    return (self.at, self._up, self._down, self._through)
+
+  @property
+  def _min(self):
+    connected = self._up | self._down
+    return min(self.at, (connected & -connected).bit_length() - 1) if connected else self.at
+
+  @property
+  def _max(self):
+    return max(self.at, (self._up | self._down).bit_length() - 1)
+
+  @property
+  def _cols(self):
+    return max(self._max + 1, self._through.bit_length())
 
   def __eq__(self, other):
     if not isinstance(other, Row):
       return False
-    return (self.at == other.at and self.up == other.up
-            and self.down == other.down and self.through == other.through)
+    return self._key() == other._key()
+
+  def __hash__(self):
+    return hash(self._key())
 
   def __repr__(self):
     r = "%s(at = %d" % (type(self).__name__, self.at)
-    if self.up:
-      r += ", up = {%s}" % ','.join(map(str, sorted(self.up)))
-    if self.down:
-      r += ", down = {%s}" % ','.join(map(str, sorted(self.down)))
-    if self.through:
-      r += ", through = {%s}" % ','.join(map(str, sorted(self.through)))
+    if self._up:
+      r += ", up = {%s}" % ','.join(map(str, _columns(self._up)))
+    if self._down:
+      r += ", down = {%s}" % ','.join(map(str, _columns(self._down)))
+    if self._through:
+      r += ", through = {%s}" % ','.join(map(str, _columns(self._through)))
     r += ")"
     return r
 
-  def _first_codepoint(self, column):
-    if column in self.through:
+  def _first_codepoint(self, column, min, max):
+    bit = 1 << column
+    if self._through & bit:
       up = down = True
       left = right = False
     else:
-      up = column in self.up
-      down = column in self.down
-      if self._min == column == self._max:
+      up = bool(self._up & bit)
+      down = bool(self._down & bit)
+      if min == column == max:
         left = right = True
-      elif self.at == column and column in self.down:
+      elif self.at == column and down:
         left = right = True
       else:
-        left = self._min < column <= self._max
-        right = self._min <= column < self._max
+        left = min < column <= max
+        right = min <= column < max
     return Row.BOX_CHARS[(1 if up else 0) + (2 if right else 0)
                          + (4 if down else 0) + (8 if left else 0)]
 
-  def _second_codepoint(self, column):
-    if column < self._cols - 1:
-      if self._min <= column < self._max:
+  def _second_codepoint(self, column, min, max, cols):
+    if column < cols - 1:
+      if min <= column < max:
         if column + 1 == self.at:
           return '▶'
         elif column == self.at:
           return '◀'
-        elif column in self.through or column + 1 in self.through:
+        elif self._through & (3 << column):
           return '┄'
         else:
           return '─'
@@ -82,38 +143,122 @@ class Row(object):
       return ''
 
   def __str__(self):
-    return ''.join(self._first_codepoint(i) + self._second_codepoint(i)
-                    for i in range(self._cols))
+    key = self._key()
+    rendered = Row._rendered.get(key)
+    if rendered is None:
+      min, max, cols = self._min, self._max, self._cols
+      rendered = ''.join(self._first_codepoint(i, min, max)
+                         + self._second_codepoint(i, min, max, cols) for i in range(cols))
+      if len(Row._rendered) >= Row.RENDER_CACHE_SIZE:
+        Row._rendered.clear()
+      Row._rendered[key] = rendered
+    return rendered
 
-def layout(branches):
-  # Sanitize data
-  branchesSet = frozenset(branches)
-  children = { b : frozenset(c for c in b.children if c in branchesSet) for b in branches }
-  parents = { b : frozenset(p for p in b.parents if p in branchesSet) for b in branches }
-
-  columns = {}
-  active = []
-  reached = set()
-  grid = []
-  for b in reversed(branches):
-    reached.add(b)
-
-    finished_parents = [p for p in parents[b] if children[p] <= reached]
-    at = min(columns[p] for p in finished_parents) if finished_parents else len(active)
-    columns[b] = at
-    down = { columns[p] for p in parents[b]}
+def _sanitize(branches):
+  """Returns each branch's parents and children, restricted to branches.
+
+  Parents are displayed after their children, except where branches have merged each other;
+  an edge back up the display order would close a cycle, and is dropped.
+  """
+  position = { b : i for i, b in enumerate(branches) }
+  parents = { b : frozenset(p for p in b.parents if position.get(p, -1) > position[b])
+              for b in branches }
+  children = { b : frozenset(c for c in b.children if position.get(c, len(branches)) < position[b])
+               for b in branches }
+  return parents, children
+
+def _layoutRows(branches, parents, children, placed = 0, columns = None, active = 0):
+  """Yields (row, active) bottom-up for each of branches above the bottom `placed` rows.
+
+  active is the bitmask of active columns once the row is placed. To resume a layout, pass
+  the columns of the branches already placed, and the active mask after the last of them.
+  """
+  columns = dict(columns or {})
+  unplaced = { b : len(children[b]) for b in branches }
+  for b in branches[len(branches) - placed:]:
     for p in parents[b]:
-      if all(c in columns for c in children[p]):
-        active[columns[p]] = None
-    through = { idx for idx, p in enumerate(active) if p and idx != at and idx not in down }
-    if children[b]:
-      while len(active) <= at:
-        active.append(None)
-      active[at] = b
-    up = { idx for idx, p in enumerate(active) if p and idx not in through }
-    while active and active[-1] is None:
-      active.pop()
-    grid.append(Row(at, up = up, down = down, through = through))
+      unplaced[p] -= 1
+
+  for b in reversed(branches[:len(branches) - placed]):
+    down = 0
+    finished = []
+    for p in parents[b]:
+      down |= 1 << columns[p]
+      unplaced[p] -= 1
+      if not unplaced[p]:
+        finished.append(columns[p])
+    at = min(finished) if finished else active.bit_length()
+    columns[b] = at
+    for column in finished:
+      active &= ~(1 << column)
+    through = active & ~down & ~(1 << at)
+    if unplaced[b]:
+      active |= 1 << at
+    up = active & ~through
+    yield Row.fromMasks(at, up = up, down = down, through = through), active
+
+def ilayout(branches):
+  """Lays out branches, yielding the Row for each one bottom-up, i.e. in reverse order.
+
+  Branches must be ordered children first, as they are displayed. Rows are laid out from the
+  bottom, parents first, so the last branch's row comes first.
+
+  Active columns (those with an edge still waiting for a child) are tracked as a bitmask, and
+  each branch counts its children yet to be placed, so each row costs time proportional to
+  its own fan-in and width, not the whole graph's.
+  """
+  branches = tuple(branches)
+  parents, children = _sanitize(branches)
+  for row, _ in _layoutRows(branches, parents, children):
+    yield row
+
+def layout(branches):
+  """Returns the Row for each of branches, in the same order."""
+  grid = list(ilayout(branches))
   grid.reverse()
   return grid
 
+class IncrementalLayout(object):
+  """Lays out branches, reusing rows from the previous layout wherever they cannot change.
+
+  A row depends only on the rows below it, so if the bottom of the new ordering matches the
+  old one (same branches, in the same order, with the same parents and children), those rows
+  are reused as is, and the layout resumes from the state they left behind. A commit to one
+  branch typically reorders only the rows above its old position.
+  """
+  def __init__(self):
+    self._branches = ()
+    self._rows = []
+    self._active = []  # The active column mask after placing each row
+    self._parents = {}
+    self._children = {}
+    self.reused = 0  # How many rows the last layout reused
+
+  def layout(self, branches):
+    """Returns the Row for each of branches, in the same order, like layout(branches)."""
+    branches = tuple(branches)
+    parents, children = _sanitize(branches)
+    old = self._branches
+    reused = 0
+    while reused < min(len(old), len(branches)):
+      b = branches[-1 - reused]
+      if (b != old[-1 - reused] or parents[b] != self._parents[b]
+          or children[b] != self._children[b]):
+        break
+      reused += 1
+    oldStart, newStart = len(old) - reused, len(branches) - reused
+    columns = { b : row.at for b, row in zip(branches[newStart:], self._rows[oldStart:]) }
+    active = self._active[oldStart] if reused else 0
+    rows, actives = [], []
+    for row, active in _layoutRows(branches, parents, children, reused, columns, active):
+      rows.append(row)
+      actives.append(active)
+    rows.reverse()
+    actives.reverse()
+    self._rows = rows + self._rows[oldStart:]
+    self._active = actives + self._active[oldStart:]
+    self._branches = branches
+    self._parents = parents
+    self._children = children
+    self.reused = reused
+    return list(self._rows)
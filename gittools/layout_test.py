@@ -1,6 +1,7 @@
 # coding=utf-8
-import sys
-from .layout import Row, layout
+import random, sys, time
+import pytest
+from .layout import IncrementalLayout, Row, ilayout, layout
 from io import StringIO
 from textwrap import dedent
 
@@ -50,6 +51,21 @@ def test_row_max_min_cols():
   assert Row(2, through={1,5})._max == 2
   assert Row(2, through={1,5})._cols == 6
 
+def test_row_from_masks():
+  assert Row.fromMasks(2, up = 0b1100, down = 0b11, through = 0b10000) == Row(
+      2, up = {2,3}, down = {0,1}, through = {4})
+  assert Row.fromMasks(1, up = 0b11).up == frozenset({0,1})
+
+def test_row_hash():
+  assert hash(Row(4, up={4}, down={1,3,4}, through={2,5})) == hash(
+      Row.fromMasks(4, up = 0b10000, down = 0b11010, through = 0b100100))
+  assert len({Row(2), Row(2), Row(2, up = {4})}) == 2
+
+def test_row_render_cache():
+  first = str(Row(4, up={4}, down={0,4}, through={1,2,3}))
+  assert str(Row(4, up={4}, down={0,4}, through={1,2,3})) is first
+  assert str(Row.fromMasks(4, up = 0b10000, down = 0b10001, through = 0b1110)) is first
+
 def test_layout_multi_branch_merge():
   gh_pages = Node("gh-pages")
   master = Node("master")
@@ -213,3 +229,107 @@ def test_row_unicode_remerge_head_into_branch():
       ├▶┘
       ┴
   """)
+
+def reference_layout(branches):
+  """The original layout algorithm, which rescans every active column on each row."""
+  branchesSet = frozenset(branches)
+  children = { b : frozenset(c for c in b.children if c in branchesSet) for b in branches }
+  parents = { b : frozenset(p for p in b.parents if p in branchesSet) for b in branches }
+  columns = {}
+  active = []
+  reached = set()
+  grid = []
+  for b in reversed(branches):
+    reached.add(b)
+    finished_parents = [p for p in parents[b] if children[p] <= reached]
+    at = min(columns[p] for p in finished_parents) if finished_parents else len(active)
+    columns[b] = at
+    down = { columns[p] for p in parents[b]}
+    for p in parents[b]:
+      if all(c in columns for c in children[p]):
+        active[columns[p]] = None
+    through = { idx for idx, p in enumerate(active) if p and idx != at and idx not in down }
+    if children[b]:
+      while len(active) <= at:
+        active.append(None)
+      active[at] = b
+    up = { idx for idx, p in enumerate(active) if p and idx not in through }
+    while active and active[-1] is None:
+      active.pop()
+    grid.append(Row(at, up = up, down = down, through = through))
+  grid.reverse()
+  return grid
+
+def random_graph(rng, count):
+  """Returns count Nodes in display order: every node comes before its parents."""
+  nodes = []
+  for i in range(count):
+    parents = rng.sample(nodes, min(len(nodes), rng.choice([0, 1, 1, 1, 2, 3])))
+    nodes.append(Node(str(i), *parents))
+  nodes.reverse()
+  return nodes
+
+def test_layout_matches_reference():
+  rng = random.Random(0)
+  for _ in range(300):
+    nodes = random_graph(rng, rng.randint(1, 25))
+    assert layout(nodes) == reference_layout(nodes)
+
+def test_ilayout_yields_bottom_up():
+  master = Node("master")
+  develop = Node("develop", master)
+  feature = Node("feature", develop)
+  rows = ilayout([feature, develop, master])
+  assert next(rows) == Row(at = 0, up = {0})
+  assert list(rows) == [Row(at = 0, up = {0}, down = {0}), Row(at = 0, down = {0})]
+
+def test_incremental_layout_matches_layout():
+  rng = random.Random(2)
+  for _ in range(50):
+    nodes = random_graph(rng, rng.randint(1, 20))
+    incremental = IncrementalLayout()
+    assert incremental.layout(nodes) == layout(nodes)
+    for step in range(10):
+      leaves = [n for n in nodes if not n.children]
+      change = rng.choice(['touch', 'add', 'remove'])
+      if change == 'touch':
+        # A commit to a branch moves it to the top
+        leaf = rng.choice(leaves)
+        nodes.remove(leaf)
+        nodes.insert(0, leaf)
+      elif change == 'add' or len(nodes) == 1:
+        parents = rng.sample(nodes, min(len(nodes), rng.choice([0, 1, 1, 2])))
+        nodes.insert(0, Node('new%d' % step, *parents))
+      else:
+        leaf = rng.choice(leaves)
+        nodes.remove(leaf)
+        for p in leaf.parents:
+          p.children.remove(leaf)
+      assert incremental.layout(nodes) == layout(nodes)
+
+def test_incremental_layout_reuses_rows_below_change():
+  master = Node('master')
+  features = [Node('feature%d' % i, master) for i in range(5)]
+  nodes = features[::-1] + [master]
+  incremental = IncrementalLayout()
+  before = incremental.layout(nodes)
+  nodes.remove(features[2])
+  nodes.insert(0, features[2])
+  after = incremental.layout(nodes)
+  assert after == layout(nodes)
+  assert incremental.reused == 3
+  assert all(a is b for a, b in zip(after[3:], before[3:]))
+  assert incremental.layout(nodes) == after
+  assert incremental.reused == len(nodes)
+
+@pytest.mark.benchmark
+def test_layout_wide_graph_benchmark():
+  # Many long-lived branches off master, each with a child: every row has many columns active
+  master = Node("master")
+  bases = [Node("base%d" % i, master) for i in range(500)]
+  tips = [Node("tip%d" % i, base) for i, base in enumerate(bases)]
+  nodes = tips + bases[::-1] + [master]
+  start = time.perf_counter()
+  grid = layout(nodes)
+  assert time.perf_counter() - start < 2.0
+  assert len(grid) == len(nodes)
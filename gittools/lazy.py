@@ -1,10 +1,10 @@
-import threading, weakref
-from collections import deque
+import threading, time, weakref
+from collections import Counter, deque
 from functools import update_wrapper
 from inspect import getcallargs
 from weakref import WeakKeyDictionary, WeakSet
 
-__all__ = ['lazy', 'lazy_invalidation']
+__all__ = ['flush_invalidations', 'lazy', 'lazy_instrumentation', 'lazy_invalidation']
 
 def lazy(object = None, listener = None):
   if object is None:
@@ -25,6 +25,25 @@ def lazy(object = None, listener = None):
 def lazy_invalidation():
   return LazyInvalidation()
 
+def lazy_instrumentation():
+  """Records what lazy results compute, and why they are invalidated, while in the context."""
+  return LazyInstrumentation()
+
+def flush_invalidations():
+  """Applies invalidations queued by other threads. Call between evaluations."""
+  assert threading.current_thread() == MAIN_THREAD
+  assert not evaluation_stack
+  invalidation_event.clear()
+  _apply_queued_invalidations()
+
+def _apply_queued_invalidations():
+  while invalidation_queue:
+    result, cause = invalidation_queue.pop()
+    result.invalidate(cause)
+
+def _label(object):
+  return getattr(object, 'label', None) or type(object).__name__
+
 class LazyConstants(object):
   def __init__(self):
     self._watchable_objects = WeakSet()
@@ -51,9 +70,14 @@ class WeakWatchIntermediary(object):
     self.result = weakref.ref(result, self.release)
     watcher.watch(self)
 
-  def __call__(self):
+  def __call__(self, detail = None):
+    cause = None
+    if instrumentation is not None:  # Only describe the cause if something will record it
+      cause = _label(self.__dict__.get('watcher'))  # Popped once released
+      if detail is not None:
+        cause += ': ' + str(detail)
     try:
-      self.result().invalidate()
+      self.result().invalidate(cause)
     except TypeError:
       pass
 
@@ -103,6 +127,108 @@ class LazyInvalidation(object):
   def _invalidate_all(self):
     raise TypeError('Cannot nest lazy_invalidation contexts')
 
+class LazyStats(object):
+  """What lazy_instrumentation recorded about the lazy results sharing one label."""
+  def __init__(self):
+    self.computes = 0
+    self.errors = 0
+    self.time = 0.0  # Seconds spent computing, including dependencies computed along the way
+    self.selfTime = 0.0  # Seconds spent computing, excluding dependencies
+    self.invalidations = Counter()  # By cause: a watcher and file, or an upstream label
+
+class LazyInstrumentation(object):
+  """Records compute counts and times, invalidation causes and dependency edges.
+
+  Lazy results are grouped by label: the qualified name of the function or property that
+  computes them. Watch-mode evaluations appear as 'continually'. Nothing is recorded, and no
+  time is spent recording, outside the context.
+  """
+  def __init__(self):
+    self.stats = {}
+    self.edges = Counter()  # (dependent label, dependency label) -> times read
+    self._childTimes = []
+
+  def __enter__(self):
+    global instrumentation
+    assert threading.current_thread() == MAIN_THREAD
+    assert instrumentation is None, 'Cannot nest lazy_instrumentation contexts'
+    instrumentation = self
+    return self
+
+  def __exit__(self, type, value, traceback):
+    global instrumentation
+    instrumentation = None
+
+  def _stats(self, result):
+    label = _label(result)
+    stats = self.stats.get(label)
+    if stats is None:
+      stats = self.stats[label] = LazyStats()
+    return stats
+
+  def _depended(self, dependent, dependency):
+    self.edges[(_label(dependent), _label(dependency))] += 1
+
+  def _invalidated(self, result, cause):
+    self._stats(result).invalidations[cause or 'explicit'] += 1
+
+  def _compute(self, result, f, args):
+    stats = self._stats(result)
+    stats.computes += 1
+    self._childTimes.append(0.0)
+    start = time.perf_counter()
+    try:
+      with LazyEvaluationContext(result):
+        try:
+          value = f(*args)
+          result._value = (value, None)
+          return value
+        except Exception as e:
+          result._value = (None, e)
+          stats.errors += 1
+          raise
+    finally:
+      elapsed = time.perf_counter() - start
+      stats.time += elapsed
+      stats.selfTime += elapsed - self._childTimes.pop()
+      if self._childTimes:
+        self._childTimes[-1] += elapsed
+
+  def profile(self):
+    """Returns a flat profile, one line per label, most expensive (excluding dependencies) first."""
+    lines = ['%8s %8s %11s %11s  %s' % ('computes', 'invalid', 'total ms', 'self ms', 'label')]
+    for label, stats in sorted(self.stats.items(), key = lambda item: -item[1].selfTime):
+      lines.append('%8d %8d %11.2f %11.2f  %s' % (
+          stats.computes, sum(stats.invalidations.values()), stats.time * 1000,
+          stats.selfTime * 1000, label))
+      for cause, count in stats.invalidations.most_common():
+        lines.append('%17s %d× by %s' % ('', count, cause))
+    return '\n'.join(lines) + '\n'
+
+  def dot(self):
+    """Returns the dependency graph in Graphviz DOT format.
+
+    Edges point from each result to what it depends on; invalidation causes that are not
+    themselves results are drawn as notes pointing at what they invalidated.
+    """
+    def quote(s):
+      return '"%s"' % s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    lines = ['digraph lazy {', '  node [shape=box];']
+    for label, stats in sorted(self.stats.items()):
+      lines.append('  %s [label=%s];' % (quote(label), quote('%s\n%d× %.1fms' % (
+          label, stats.computes, stats.time * 1000))))
+    for (dependent, dependency), count in sorted(self.edges.items()):
+      lines.append('  %s -> %s [label=%d];' % (quote(dependent), quote(dependency), count))
+    causes = set()
+    for label, stats in sorted(self.stats.items()):
+      for cause, count in sorted(stats.invalidations.items()):
+        if cause not in self.stats and cause not in causes:
+          causes.add(cause)
+          lines.append('  %s [shape=note];' % quote(cause))
+        lines.append('  %s -> %s [style=dashed, label=%d];' % (quote(cause), quote(label), count))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
 class LazyEvaluationContext(object):
   def __init__(self, lazyObject):
     self.lazyObject = lazyObject
@@ -118,37 +244,43 @@ class LazyEvaluationContext(object):
     evaluation_stack.pop()
     self.lazyObject.deps = frozenset(self.lazyObject.deps)
     if not evaluation_stack:
-      while invalidation_queue:
-        invalidation_queue.pop().invalidate()
+      _apply_queued_invalidations()
 
 class LazyResult(object):
   inited = False
   deps = None  # Stores hard references to upstream dependencies for invalidation purposes
 
-  def __init__(self, watcher = None):
+  def __init__(self, watcher = None, label = None):
     self.watcher = watcher
+    self.label = label
 
-  def invalidate(self):
+  def invalidate(self, cause = None):
+    """Discards the cached value. cause describes why, for lazy_instrumentation."""
     if not hasattr(self, '_value'):
       return
     if threading.current_thread() != MAIN_THREAD or evaluation_stack:
-      invalidation_queue.append(self)
+      invalidation_queue.append((self, cause))
       invalidation_event.set()
       return
     del self._value
     self.deps = None
+    if instrumentation is not None:
+      instrumentation._invalidated(self, cause)
     try:
       refs = tuple(self._refs)
     except AttributeError:
       return
     self._refs.clear()
     for ref in refs:
-      ref.invalidate()
+      ref.invalidate(_label(self))
 
   def set(self, value):
     assert not hasattr(self, '_value')
     self._value = (value, None)
 
+  def is_cached(self):
+    return hasattr(self, '_value')
+
   def get(self, f, *args):
     assert threading.current_thread() == MAIN_THREAD
     if not self.inited:
@@ -158,9 +290,13 @@ class LazyResult(object):
       if not hasattr(self, '_refs'):
         self._refs = WeakSet()
       self._refs.add(evaluation_stack[-1])
+      if instrumentation is not None:
+        instrumentation._depended(evaluation_stack[-1], self)
     try:
       value, e = self._value
     except AttributeError:
+      if instrumentation is not None:
+        return instrumentation._compute(self, f, args)
       with LazyEvaluationContext(self):
         try:
           value = f(*args)
@@ -176,12 +312,13 @@ class LazyResult(object):
 class LazyFunction(object):
   def __init__(self, func, listener = None):
     self.__func__ = func
+    label = getattr(func, '__qualname__', None) or type(func).__qualname__
     if listener is not None:
-      self._value = LazyResult(listener)
+      self._value = LazyResult(listener, label)
     elif hasattr(func, 'watch'):
-      self._value = LazyResult(func)
+      self._value = LazyResult(func, label)
     else:
-      self._value = LazyResult()
+      self._value = LazyResult(label = label)
 
   def __call__(self):
     return self._value.get(self.__func__)
@@ -197,11 +334,17 @@ class LazyFunction(object):
   def invalidate(self):
     self._value.invalidate()
 
+  def prime(self, value):
+    """Sets the result of this function, as if it had just been computed."""
+    self._value.set(value)
+
+  def is_cached(self):
+    """Whether this function's result is available without calling it."""
+    return self._value.is_cached()
+
   def continually(self):
     while True:
-      invalidation_event.clear()
-      while invalidation_queue:
-        invalidation_queue.pop().invalidate()
+      flush_invalidations()
       with LazyEvaluationContext(invalidation_event):
         self()
       while not invalidation_event.is_set():
@@ -239,7 +382,9 @@ class LazyInstanceMethod(object):
     else:
       args = (self.__self__,) + args
       allargs = tuple(getcallargs(self.__func__, *args, **kwargs).items())[1:]
-      result = self._results.setdefault(allargs, LazyResult())
+      result = self._results.get(allargs)
+      if result is None:
+        result = self._results.setdefault(allargs, LazyResult(label = self.__func__.__qualname__))
       return result.get(self.__func__, *args, **kwargs)
 
   def __repr__(self):
@@ -258,6 +403,10 @@ class PropertyWatchWrapper(object):
     self.obj = obj
     self.storage = Storage()
 
+  @property
+  def label(self):
+    return _label(self.func)
+
   def watch(self, callback):
     self.func.watch(self.obj, self.storage, callback)
   
@@ -269,18 +418,30 @@ class LazyProperty(object):
   def __init__(self, delegate):
     self.delegate = delegate
 
-  def __get__(self, obj, objtype=None):
-    if obj is None:
-      return self
+  def _result(self, obj):
     try:
-      lazy_result = obj.__dict__[self.__name__]
+      return obj.__dict__[self.__name__]
     except KeyError:
+      label = getattr(self, '__qualname__', None) or self.__name__
       if hasattr(self.delegate, 'watch'):
-        lazy_result = LazyResult(PropertyWatchWrapper(self.delegate, obj))
+        lazy_result = LazyResult(PropertyWatchWrapper(self.delegate, obj), label)
       else:
-        lazy_result = LazyResult()
+        lazy_result = LazyResult(label = label)
       obj.__dict__[self.__name__] = lazy_result
-    return lazy_result.get(self.delegate.__get__, obj, objtype)
+      return lazy_result
+
+  def __get__(self, obj, objtype=None):
+    if obj is None:
+      return self
+    return self._result(obj).get(self.delegate.__get__, obj, objtype)
+
+  def prime(self, obj, value):
+    """Sets the value of this property on obj, as if it had just been computed."""
+    self._result(obj).set(value)
+
+  def is_cached(self, obj):
+    """Whether this property's value on obj is available without computing it."""
+    return self._result(obj).is_cached()
 
   def __set__(self, obj, value):
     raise AttributeError()
@@ -291,5 +452,7 @@ invalidation_queue = deque()
 invalidation_strategy = LazyConstants()
 invalidation_event = threading.Event()
 
-invalidation_event.invalidate = invalidation_event.set
+invalidation_event.invalidate = lambda cause = None: invalidation_event.set()
+invalidation_event.label = 'continually'
+instrumentation = None  # The active LazyInstrumentation, if any
 
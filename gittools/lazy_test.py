@@ -1,6 +1,8 @@
 import weakref
 from itertools import count
-from .lazy import lazy, lazy_invalidation, invalidation_strategy, LazyInvalidation
+import pytest
+from .lazy import (lazy, lazy_instrumentation, lazy_invalidation, invalidation_strategy,
+                   LazyInvalidation, WeakWatchIntermediary)
 from .utils import staticproperty
 
 class DummyListener(object):
@@ -96,6 +98,37 @@ def test_property_cached():
   assert 1 == f.bar
   assert 1 == f.bar
 
+def test_property_prime():
+  i = [0]
+  class Foo(object):
+    @lazy
+    @property
+    def bar(self):
+      i[0] += 1
+      return i[0]
+  f = Foo()
+  assert not Foo.bar.is_cached(f)
+  Foo.bar.prime(f, 7)
+  assert Foo.bar.is_cached(f)
+  assert 7 == f.bar
+  assert i[0] == 0
+  assert 1 == Foo().bar
+
+def test_function_prime():
+  i = [0]
+  @lazy
+  def foo():
+    i[0] += 1
+    return i[0]
+  assert not foo.is_cached()
+  foo.prime(7)
+  assert foo.is_cached()
+  assert 7 == foo()
+  assert i[0] == 0
+  foo.invalidate()
+  assert not foo.is_cached()
+  assert 1 == foo()
+
 def test_staticproperty():
   i = [0]
   class Foo(object):
@@ -348,3 +381,67 @@ def test_dependency_still_watched_when_no_explicit_references_remain():
     assert listener.release_calls == 1
     assert bar() == 6
 
+
+def test_instrumentation():
+  listener = DummyListener()
+
+  @lazy(listener = listener)
+  def leaf():
+    return 1
+
+  @lazy
+  def root():
+    return leaf() + leaf()
+
+  with lazy_invalidation():
+    root()
+    with lazy_instrumentation() as instrumentation:
+      listener.callback('refs/heads/foo')
+      assert root() == 2
+      assert root() == 2
+      root.invalidate()
+      assert root() == 2
+    listener.callback()
+    root()
+
+  stats = instrumentation.stats
+  leafLabel = leaf.__qualname__
+  rootLabel = root.__qualname__
+  assert set(stats) == {leafLabel, rootLabel}
+  assert stats[leafLabel].computes == 1
+  assert stats[rootLabel].computes == 2
+  assert stats[leafLabel].invalidations == {'DummyListener: refs/heads/foo': 1}
+  assert stats[rootLabel].invalidations == {leafLabel: 1, 'explicit': 1}
+  assert stats[rootLabel].time >= stats[rootLabel].selfTime >= 0
+  assert instrumentation.edges == {(rootLabel, leafLabel): 4}
+
+  profile = instrumentation.profile().splitlines()
+  assert profile[0].split() == ['computes', 'invalid', 'total', 'ms', 'self', 'ms', 'label']
+  assert any(l.endswith(rootLabel) and l.split()[:2] == ['2', '2'] for l in profile)
+  assert '1× by DummyListener: refs/heads/foo' in instrumentation.profile()
+
+  dot = instrumentation.dot()
+  assert dot.startswith('digraph lazy {')
+  assert '"%s" -> "%s" [label=4];' % (rootLabel, leafLabel) in dot
+  assert '"DummyListener: refs/heads/foo" [shape=note];' in dot
+  assert '"%s" -> "%s" [style=dashed, label=1];' % (leafLabel, rootLabel) in dot
+
+def test_watch_callback_without_instrumentation():
+  class LabelledListener(DummyListener):
+    labels = 0
+
+    @property
+    def label(self):
+      self.labels += 1
+      return 'LabelledListener'
+
+  class BrokenResult(object):
+    def invalidate(self, cause = None):
+      raise AttributeError('A bug in the result')
+
+  listener = LabelledListener()
+  result = BrokenResult()
+  WeakWatchIntermediary(result, listener)
+  with pytest.raises(AttributeError):
+    listener.callback('refs/heads/foo')
+  assert listener.labels == 0  # No cause is described when nothing records it
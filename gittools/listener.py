@@ -1,4 +1,6 @@
-import signal
+import os, signal, threading
+from collections import deque
+from contextlib import contextmanager
 
 class SignalListener(object):
   def __init__(self, signum):
@@ -19,3 +21,50 @@ class SignalListener(object):
   def unwatch(self):
     signal.signal(self.signum, self._next_signal)
 
+class KeyListener(object):
+  """Reads keypresses from a terminal on a background thread, calling back after each read.
+
+  Input is queued on keys as read, e.g. 'j' or '\\x1b[B', for the main thread to consume.
+  """
+  def __init__(self, fd):
+    self.fd = fd
+    self.keys = deque()
+    self._callback = None
+    self._thread = None
+
+  def watch(self, callback):
+    self._callback = callback
+    if self._thread is None:
+      self._thread = threading.Thread(target = self._read, daemon = True)
+      self._thread.start()
+
+  def _read(self):
+    while True:
+      try:
+        data = os.read(self.fd, 64)
+      except OSError:
+        return
+      if not data:
+        return
+      self.keys.append(data.decode('utf-8', 'replace'))
+      callback = self._callback
+      if callback is not None:
+        callback()
+
+  def unwatch(self):
+    self._callback = None
+
+@contextmanager
+def cbreak(stream):
+  """Delivers keypresses on stream as they are typed, without echoing them, if it is a terminal."""
+  if not stream.isatty():
+    yield
+    return
+  import termios, tty
+  fd = stream.fileno()
+  attributes = termios.tcgetattr(fd)
+  try:
+    tty.setcbreak(fd)
+    yield
+  finally:
+    termios.tcsetattr(fd, termios.TCSADRAIN, attributes)
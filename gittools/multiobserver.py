@@ -1,6 +1,22 @@
-import watchdog.observers
+__all__ = ['OBSERVER', 'FileSystemEventHandler']
 
-__all__ = ['OBSERVER']
+class FileSystemEventHandler(object):
+  """Base class for handlers of watchdog events.
+
+  Dispatches like watchdog.events.FileSystemEventHandler, without importing watchdog, which
+  is only loaded once something is actually watched.
+  """
+  def dispatch(self, event):
+    self.on_any_event(event)
+    handler = getattr(self, 'on_' + event.event_type, None)
+    if handler is not None:
+      handler(event)
+
+  def on_any_event(self, event):
+    pass
+
+# Reported by inotify on newer watchdog releases whenever a file is merely read
+READ_ONLY_EVENTS = frozenset(['opened', 'closed_no_write'])
 
 class DispatchingHandler(object):
   def __init__(self):
@@ -16,6 +32,8 @@ class DispatchingHandler(object):
     return self.handlers
 
   def dispatch(self, event):
+    if event.event_type in READ_ONLY_EVENTS:
+      return  # git reading refs is not a change, and would otherwise invalidate continually
     for handler in self.handlers:
       handler.dispatch(event)
 
@@ -28,6 +46,7 @@ class MultiObserver(object):
     try:
       multi_handler = self._handlers[directory]
     except KeyError:
+      import watchdog.observers
       self._observers[directory] = observer = watchdog.observers.Observer()
       self._handlers[directory] = multi_handler = DispatchingHandler()
       observer.schedule(self._handlers[directory], directory, recursive = True)
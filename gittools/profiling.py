@@ -0,0 +1,166 @@
+import os, threading, time
+from collections import Counter, namedtuple
+from functools import wraps
+from .utils import commandName, ShAccounting
+
+__all__ = ['Profiler', 'inPhase', 'phase']
+
+Span = namedtuple('Span', 'name start end thread')
+
+profiler = None  # The active Profiler, if any
+
+class _NoPhase(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    pass
+
+NO_PHASE = _NoPhase()
+
+class _Phase(object):
+  __slots__ = ('profiler', 'name', 'start')
+
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    self.profiler._enter()
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.profiler._exit(self, time.perf_counter())
+
+def phase(name):
+  """Attributes the time spent in the context to the named phase, e.g. 'layout'.
+
+  Time spent in a nested phase counts towards that phase alone. Does nothing unless a Profiler
+  is active.
+  """
+  if profiler is None:
+    return NO_PHASE
+  return _Phase(profiler, name)
+
+def inPhase(name):
+  """Decorates a function so that each call runs in the named phase."""
+  def decorator(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+      with phase(name):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+class Profiler(object):
+  """While active, attributes wall time to phases and records every subprocess it starts.
+
+  Commands still running when the profile ends, e.g. long-lived streams, are listed as such.
+  """
+  def __init__(self):
+    self.spans = []
+    self.accounting = ShAccounting()
+    self.commands = self.accounting.records  # ShRecords of the commands that exited
+    self.phaseTimes = Counter()  # Seconds spent in each phase, excluding nested phases
+    self.phaseCounts = Counter()
+    self.start = self.end = None
+    self._stacks = threading.local()
+
+  def __enter__(self):
+    global profiler
+    assert profiler is None, 'Cannot nest Profilers'
+    profiler = self
+    self.accounting.__enter__()  # Its hooks are called from any thread
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, type, value, traceback):
+    global profiler
+    self.end = time.perf_counter()
+    self.accounting.__exit__(type, value, traceback)
+    profiler = None
+
+  def _stack(self):
+    try:
+      return self._stacks.stack
+    except AttributeError:
+      self._stacks.stack = []
+      return self._stacks.stack
+
+  def _enter(self):
+    self._stack().append(0.0)  # Time spent in nested phases
+
+  def _exit(self, phase, end):
+    stack = self._stack()
+    elapsed = end - phase.start
+    self.phaseTimes[phase.name] += elapsed - stack.pop()
+    self.phaseCounts[phase.name] += 1
+    if stack:
+      stack[-1] += elapsed
+    self.spans.append(Span(phase.name, phase.start, end, threading.get_ident()))
+
+  def summary(self, slowest = 5):
+    """Returns a table of time by phase, then of subprocesses by command."""
+    total = (self.end or time.perf_counter()) - self.start
+    lines = ['%-12s %10s %6s %7s' % ('phase', 'ms', '%', 'count')]
+    phases = list(self.phaseTimes.most_common())
+    phases.append(('(other)', total - sum(self.phaseTimes.values())))
+    for name, seconds in phases:
+      lines.append('%-12s %10.1f %5.1f%% %7s' % (
+          name, seconds * 1000, 100 * seconds / total if total else 0,
+          self.phaseCounts.get(name, '')))
+    lines.append('%-12s %10.1f' % ('total', total * 1000))
+
+    lines.append('')
+    lines.append('Subprocesses: ' + self.accounting.summary().rstrip('\n'))
+    running = Counter(self.accounting.started) - Counter(c.cmd for c in self.commands)
+    if running:
+      lines.append('Still running:')
+      for cmd, count in sorted(running.items()):
+        argv = ' '.join(cmd)
+        lines.append('%10s     %s' % ('×%d' % count if count > 1 else '',
+                                      argv if len(argv) <= 100 else argv[:99] + '…'))
+    if self.commands:
+      lines.append('Slowest:')
+      for command in sorted(self.commands, key = lambda c: c.start - c.end)[:slowest]:
+        argv = ' '.join(command.cmd)
+        lines.append('%10.1f ms  %s' % ((command.end - command.start) * 1000,
+                                        argv if len(argv) <= 100 else argv[:99] + '…'))
+    return '\n'.join(lines) + '\n'
+
+  def chromeTrace(self):
+    """Returns the profile in Chrome's trace event format, which speedscope can also open.
+
+    Phases appear on the thread that ran them; subprocesses, which overlap freely, are spread
+    over as many extra lanes as are needed to keep them apart.
+    """
+    pid = os.getpid()
+    def micros(t):
+      return (t - self.start) * 1e6
+    events = []
+    threads = {}
+    for span in self.spans:
+      tid = threads.setdefault(span.thread, len(threads) + 1)
+      events.append({'name': span.name, 'cat': 'phase', 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': round(micros(span.start), 1),
+                     'dur': round(micros(span.end) - micros(span.start), 1)})
+    laneEnds = []
+    for command in sorted(self.commands, key = lambda c: c.start):
+      lane = next((i for i, end in enumerate(laneEnds) if end <= command.start), len(laneEnds))
+      if lane == len(laneEnds):
+        laneEnds.append(None)
+      laneEnds[lane] = command.end
+      events.append({'name': commandName(command.cmd), 'cat': 'subprocess', 'ph': 'X',
+                     'pid': pid, 'tid': 1000 + lane, 'ts': round(micros(command.start), 1),
+                     'dur': round(micros(command.end) - micros(command.start), 1),
+                     'args': {'argv': list(command.cmd), 'bytesRead': command.bytesRead,
+                              'returncode': command.returncode}})
+    for ident, tid in threads.items():
+      name = 'main' if ident == threading.main_thread().ident else 'thread %d' % tid
+      events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                     'args': {'name': name}})
+    for lane in range(len(laneEnds)):
+      events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': 1000 + lane,
+                     'args': {'name': 'subprocesses %d' % (lane + 1)}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
@@ -0,0 +1,68 @@
+import json
+from . import profiling
+from .profiling import NO_PHASE, Profiler, inPhase, phase
+from .utils import Sh, ShRecord
+
+def test_phase_without_profiler():
+  assert phase('layout') is NO_PHASE
+  with phase('layout'):
+    pass
+
+def test_nested_phases_are_exclusive():
+  clock = iter(range(100))
+  @inPhase('render')
+  def render():
+    with phase('history'):
+      pass
+    with phase('history'):
+      pass
+  with Profiler() as profiler:
+    profiling.time.perf_counter, perf_counter = lambda: next(clock), profiling.time.perf_counter
+    try:
+      render()
+    finally:
+      profiling.time.perf_counter = perf_counter
+  assert profiler.phaseCounts == {'render': 1, 'history': 2}
+  assert profiler.phaseTimes == {'render': 3, 'history': 2}
+  assert [s.name for s in profiler.spans] == ['history', 'history', 'render']
+  assert profiling.profiler is None
+
+def test_records_subprocesses():
+  with Profiler() as profiler:
+    assert str(Sh('echo', 'hi')) == 'hi\n'
+    assert list(Sh('printf', r'a\nb')) == ['a', 'b']
+    with Sh('echo', 'hi'):
+      pass
+  assert [c.cmd[0] for c in profiler.commands] == ['echo', 'printf', 'echo']
+  assert all(c.end >= c.start for c in profiler.commands)
+  assert profiler.commands[0].bytesRead == 3
+  assert Sh.hooks == Sh.startHooks == ()
+  summary = profiler.summary()
+  assert 'Subprocesses: 3 commands' in summary
+  assert any(l.split()[:1] == ['2'] and l.endswith('  echo hi') for l in summary.splitlines())
+
+def test_reports_commands_still_running():
+  with Profiler() as profiler:
+    with Sh('true'):
+      pass
+    stream = Sh('sleep', '10')  # Like a git log stream that is never read to the end
+  with stream:
+    summary = profiler.summary()
+  assert [c.cmd for c in profiler.commands] == [('true',)]
+  assert 'Subprocesses: 1 commands' in summary
+  assert '1 still running' in summary
+  assert summary.split('Still running:\n')[1].splitlines()[0].split() == ['sleep', '10']
+
+def test_chrome_trace_lanes():
+  profiler = Profiler()
+  profiler.start = 0.0
+  profiler.commands = [ShRecord(('git', 'log', 'a'), 0.0, 2.0, 10, 0),
+                       ShRecord(('git', 'log', 'b'), 1.0, 3.0, 10, 0),
+                       ShRecord(('git', 'log', 'c'), 2.5, 4.0, 0, 1)]
+  trace = json.loads(json.dumps(profiler.chromeTrace()))
+  commands = [e for e in trace['traceEvents'] if e.get('cat') == 'subprocess']
+  assert [(e['tid'], e['ts'], e['dur']) for e in commands] == [
+      (1000, 0, 2e6), (1001, 1e6, 2e6), (1000, 2.5e6, 1.5e6)]
+  assert commands[2]['args'] == {'argv': ['git', 'log', 'c'], 'bytesRead': 0, 'returncode': 1}
+  lanes = [e['args']['name'] for e in trace['traceEvents'] if e['ph'] == 'M']
+  assert lanes == ['subprocesses 1', 'subprocesses 2']
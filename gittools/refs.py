@@ -0,0 +1,327 @@
+import mmap, os, re
+from collections import namedtuple
+from .utils import Sh
+
+__all__ = ['findGitDir', 'PackedRefs', 'Ref', 'RefSnapshot', 'RefStore']
+
+Ref = namedtuple('Ref', 'fullName name hash upstream authorTime symref')
+
+class RefSnapshot(object):
+  """The state of every local and remote branch, as reported by a single `git for-each-ref`.
+
+  Branches are keyed by their short name, e.g. 'develop' or 'origin/develop'.
+  """
+  FIELDS = ('%(refname)', '%(refname:short)', '%(objectname)', '%(upstream:short)',
+            '%(authordate:raw)', '%(symref)')
+  FORMAT = '%00'.join(FIELDS)
+
+  def __init__(self, refs):
+    self._refs = {}
+    for ref in refs:
+      self._refs[ref.name] = ref
+
+  @classmethod
+  def load(cls):
+    raw = Sh('/usr/local/bin/git', 'for-each-ref', '--format=' + cls.FORMAT,
+             'refs/heads', 'refs/remotes')
+    return cls(cls.parse(line) for line in raw)
+
+  @staticmethod
+  def parse(line):
+    fullName, name, hash, upstream, authorDate, symref = line.split('\0')
+    try:
+      authorTime = int(authorDate.split()[0])
+    except (IndexError, ValueError):
+      authorTime = None
+    return Ref(fullName, name, hash, upstream or None, authorTime, symref or None)
+
+  def _names(self, prefix):
+    return tuple(ref.name for ref in self._refs.values()
+                 if ref.fullName.startswith(prefix) and ref.symref is None)
+
+  @property
+  def branches(self):
+    """Short names of all local branches."""
+    return self._names('refs/heads/')
+
+  @property
+  def remotes(self):
+    """Short names of all remote branches, excluding symbolic refs like origin/HEAD."""
+    return self._names('refs/remotes/')
+
+  def __contains__(self, name):
+    return name in self._refs
+
+  def get(self, name):
+    """Returns the Ref for the named branch, or None if it does not exist."""
+    return self._refs.get(name)
+
+  def hash(self, name):
+    """Returns the commit the named branch points to, or None if it does not exist."""
+    ref = self._refs.get(name)
+    return ref and ref.hash
+
+  def upstream(self, name):
+    """Returns the short name of the named branch's upstream, or None if none is set."""
+    ref = self._refs.get(name)
+    return ref and ref.upstream
+
+def findGitDir(cwd = None):
+  """Returns the git dir for cwd, as `git rev-parse --git-dir` would, or None if not found.
+
+  Like git, returns '.git' at the top of a work tree and an absolute path elsewhere.
+  """
+  if 'GIT_DIR' in os.environ:
+    return os.environ['GIT_DIR']
+  cwd = os.path.abspath(cwd or os.getcwd())
+  directory = cwd
+  while True:
+    dotgit = os.path.join(directory, '.git')
+    if os.path.isdir(dotgit):
+      return '.git' if directory == cwd else dotgit
+    if os.path.isfile(dotgit):
+      with open(dotgit) as f:
+        line = f.readline().strip()
+      if not line.startswith('gitdir: '):
+        return None
+      return os.path.normpath(os.path.join(directory, line[len('gitdir: '):]))
+    if os.path.isfile(os.path.join(directory, 'HEAD')) and os.path.isdir(
+        os.path.join(directory, 'refs')) and os.path.isdir(os.path.join(directory, 'objects')):
+      return '.' if directory == cwd else directory  # Bare repository
+    parent = os.path.dirname(directory)
+    if parent == directory:
+      return None
+    directory = parent
+
+class PackedRefs(object):
+  """A memory-mapped view of a packed-refs file.
+
+  Sorted files (the default since git 2.x) are binary-searched in place; unsorted files are
+  indexed once on first lookup.
+  """
+  def __init__(self, path):
+    self.path = path
+    self._data = b''
+    self._index = None
+    self._start = 0
+    try:
+      with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+          self._data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    except (IOError, OSError):
+      return
+    if self._data[:1] == b'#':
+      header_end = self._data.find(b'\n') + 1 or len(self._data)
+      traits = self._data[:header_end].split()
+      self._start = header_end
+      if b'sorted' not in traits:
+        self._buildIndex()
+    elif self._data:
+      self._buildIndex()
+
+  def _buildIndex(self):
+    self._index = {}
+    for line in self._data[self._start:].split(b'\n'):
+      if line and line[:1] not in (b'^', b'#'):
+        hash, name = line.rstrip(b'\r').split(b' ', 1)
+        self._index[name] = hash
+
+  def items(self):
+    """Yields (refname, hash) for every packed ref, in file order."""
+    for line in self._data[self._start:].split(b'\n'):
+      if line and line[:1] not in (b'^', b'#'):
+        hash, name = line.rstrip(b'\r').split(b' ', 1)
+        yield name.decode('utf-8'), hash.decode('ascii')
+
+  def _nextRecord(self, pos):
+    """Returns the offset of the first record at or after pos, skipping peeled lines."""
+    data = self._data
+    while pos < len(data) and data[pos:pos + 1] == b'^':
+      pos = data.find(b'\n', pos)
+      pos = len(data) if pos == -1 else pos + 1
+    return pos
+
+  def get(self, refname):
+    """Returns the hash refname points to, or None if it is not packed."""
+    target = refname.encode('utf-8')
+    if self._index is not None:
+      hash = self._index.get(target)
+      return hash and hash.decode('ascii')
+    data = self._data
+    lo, hi = self._start, len(data)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      newline = data.rfind(b'\n', lo, mid)
+      start = lo if newline == -1 else newline + 1
+      while data[start:start + 1] == b'^' and start > lo:
+        newline = data.rfind(b'\n', lo, start - 1)
+        start = lo if newline == -1 else newline + 1
+      end = data.find(b'\n', start)
+      if end == -1:
+        end = len(data)
+      hash, _, name = data[start:end].rstrip(b'\r').partition(b' ')
+      if name == target:
+        return hash.decode('ascii')
+      elif name < target:
+        lo = self._nextRecord(end + 1)
+      else:
+        hi = start
+    return None
+
+class RefStore(object):
+  """Resolves refs by reading HEAD, loose refs and packed-refs directly from a git dir.
+
+  Only plain ref names are supported; callers should fall back to git for anything else.
+  """
+  # The order git tries to expand short names in, e.g. 'develop' -> 'refs/heads/develop'
+  RULES = ('%s', 'refs/%s', 'refs/tags/%s', 'refs/heads/%s', 'refs/remotes/%s',
+           'refs/remotes/%s/HEAD')
+  HASH_RE = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+  INVALID_NAME_RE = re.compile(r'[\x00-\x20~^:?*\[\\\x7f]|\.\.|@[{]|//|^[-/.]|[/.]$|\.lock$')
+
+  def __init__(self, gitDir):
+    self.gitDir = gitDir
+    try:
+      with open(os.path.join(gitDir, 'commondir')) as f:
+        self.commonDir = os.path.normpath(os.path.join(gitDir, f.readline().strip()))
+    except (IOError, OSError):
+      self.commonDir = gitDir
+    self._packed = None
+    self._packedKey = None
+
+  @classmethod
+  def isPlainName(cls, name):
+    return bool(name) and not cls.INVALID_NAME_RE.search(name)
+
+  def _packedRefs(self):
+    path = os.path.join(self.commonDir, 'packed-refs')
+    try:
+      st = os.stat(path)
+      key = (st.st_ino, st.st_size, st.st_mtime_ns)
+    except OSError:
+      key = None
+    if key != self._packedKey:
+      self._packed = PackedRefs(path) if key else None
+      self._packedKey = key
+    return self._packed
+
+  def _loosePath(self, refname):
+    if '/' not in refname or refname.startswith(('refs/bisect/', 'refs/worktree/')):
+      return os.path.join(self.gitDir, refname)
+    return os.path.join(self.commonDir, refname)
+
+  def read(self, refname):
+    """Returns ('ref', target) for a symbolic ref, ('hash', hash) otherwise, or None."""
+    try:
+      with open(self._loosePath(refname), 'rb') as f:
+        value = f.read().strip().decode('utf-8')
+      if value.startswith('ref: '):
+        return ('ref', value[5:].strip())
+      if RefStore.HASH_RE.match(value):
+        return ('hash', value)
+      return None
+    except (IOError, OSError, UnicodeDecodeError):
+      pass
+    if '/' not in refname:
+      return None  # Pseudo-refs like HEAD are never packed
+    packed = self._packedRefs()
+    hash = packed and packed.get(refname)
+    return ('hash', hash) if hash else None
+
+  def resolve(self, refname):
+    """Returns the hash refname points to, following symbolic refs, or None."""
+    for _ in range(5):
+      value = self.read(refname)
+      if value is None:
+        return None
+      kind, refname = value
+      if kind == 'hash':
+        return refname
+    return None
+
+  def exists(self, refname):
+    return self.resolve(refname) is not None
+
+  def refs(self, *prefixes):
+    """Returns {refname: value} for every ref under the given prefixes, e.g. 'refs/heads/'.
+
+    value is the hash, or 'ref: <target>' for symbolic refs.
+    """
+    refs = {}
+    packed = self._packedRefs()
+    if packed is not None:
+      refs.update((name, hash) for name, hash in packed.items() if name.startswith(prefixes))
+    for prefix in prefixes:
+      root = os.path.join(self.commonDir, prefix)
+      for directory, _, files in os.walk(root):
+        for filename in files:
+          if filename.endswith('.lock'):
+            continue
+          refname = os.path.relpath(os.path.join(directory, filename), self.commonDir)
+          refname = refname.replace(os.sep, '/')
+          value = self.read(refname)
+          if value is not None:
+            refs[refname] = value[1] if value[0] == 'hash' else 'ref: ' + value[1]
+    return refs
+
+  def expand(self, name):
+    """Returns the full ref name a short name resolves to, like `--symbolic-full-name`.
+
+    Returns None if name is not a plain ref name, or does not name a ref.
+    """
+    if not RefStore.isPlainName(name):
+      return None
+    for rule in RefStore.RULES:
+      refname = rule % name
+      if refname != 'HEAD' and '/' not in refname and not refname.endswith('HEAD'):
+        continue  # Only HEAD-like pseudo-refs are looked up in the top of the git dir
+      value = self.read(refname)
+      if value is None:
+        continue
+      if refname == name == 'HEAD' and value[0] == 'ref':
+        return value[1]
+      return refname if self.resolve(refname) else None
+    return None
+
+  def shorten(self, refname):
+    """Returns the shortest unambiguous name for refname, like `--abbrev-ref`."""
+    for i in range(len(RefStore.RULES) - 1, 0, -1):
+      prefix, _, suffix = RefStore.RULES[i].partition('%s')
+      if not (refname.startswith(prefix) and refname.endswith(suffix)):
+        continue
+      short = refname[len(prefix):len(refname) - len(suffix)]
+      if not short:
+        continue
+      if not any(self.exists(rule % short) for j, rule in enumerate(RefStore.RULES) if j != i):
+        return short
+    return refname
+
+  def revparse(self, *args):
+    """Answers the simplest forms of `git rev-parse`, or returns None if git is needed.
+
+    Supports `--git-dir`, `--symbolic-full-name <name>`, `--abbrev-ref <name>` and lists of
+    plain ref names.
+    """
+    if args == ('--git-dir',):
+      return self.gitDir
+    if len(args) == 2 and args[0] == '--symbolic-full-name':
+      return self.expand(args[1])
+    if len(args) == 2 and args[0] == '--abbrev-ref':
+      if args[1] == 'HEAD':
+        value = self.read('HEAD')
+        if value is None:
+          return None
+        return 'HEAD' if value[0] == 'hash' else self.shorten(value[1])
+      refname = self.expand(args[1])
+      return refname and self.shorten(refname)
+    hashes = []
+    for arg in args:
+      if RefStore.HASH_RE.match(arg):
+        hashes.append(arg)
+        continue
+      refname = self.expand(arg)
+      hash = refname and self.resolve(refname)
+      if not hash:
+        return None
+      hashes.append(hash)
+    return '\n'.join(hashes) if hashes else None
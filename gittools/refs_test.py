@@ -0,0 +1,91 @@
+from .refs import findGitDir, PackedRefs, Ref, RefSnapshot, RefStore
+from .testing import git
+
+def snapshot(*lines):
+  return RefSnapshot(RefSnapshot.parse(l) for l in lines)
+
+def test_parse():
+  ref = RefSnapshot.parse('refs/heads/feature\0feature\0abc123\0origin/develop\0'
+                          '1500000000 +0100\0')
+  assert ref == Ref('refs/heads/feature', 'feature', 'abc123', 'origin/develop', 1500000000, None)
+
+def test_parse_no_upstream():
+  ref = RefSnapshot.parse('refs/heads/master\0master\0abc123\0\0' '1500000000 +0100\0')
+  assert ref.upstream is None
+
+def test_branches_and_remotes():
+  refs = snapshot('refs/heads/master\0master\0a\0origin/master\0' '1 +0000\0',
+                  'refs/remotes/origin/HEAD\0origin\0a\0\0' '1 +0000\0refs/remotes/origin/master',
+                  'refs/remotes/origin/master\0origin/master\0b\0\0' '1 +0000\0')
+  assert refs.branches == ('master',)
+  assert refs.remotes == ('origin/master',)
+  assert refs.hash('origin/master') == 'b'
+  assert refs.upstream('master') == 'origin/master'
+  assert refs.upstream('origin/master') is None
+  assert refs.get('missing') is None
+  assert refs.hash('missing') is None
+
+PACKED_REFS = b"""# pack-refs with: peeled fully-peeled sorted 
+%s refs/heads/a
+%s refs/heads/b
+%s refs/tags/v1
+^%s
+%s refs/tags/v2
+^%s
+%s refs/tags/v3
+"""
+
+def test_packed_refs_binary_search(tmp_path):
+  hashes = [('%d' % i) * 40 for i in range(7)]
+  path = tmp_path / 'packed-refs'
+  path.write_bytes(PACKED_REFS % tuple(h.encode() for h in hashes))
+  packed = PackedRefs(str(path))
+  assert packed._index is None
+  assert packed.get('refs/heads/a') == hashes[0]
+  assert packed.get('refs/heads/b') == hashes[1]
+  assert packed.get('refs/tags/v1') == hashes[2]
+  assert packed.get('refs/tags/v2') == hashes[4]
+  assert packed.get('refs/tags/v3') == hashes[6]
+  assert packed.get('refs/heads/c') is None
+  assert packed.get('refs/tags/v0') is None
+
+def test_packed_refs_unsorted(tmp_path):
+  path = tmp_path / 'packed-refs'
+  path.write_bytes(b'%s refs/heads/z\n%s refs/heads/a\n' % (b'1' * 40, b'2' * 40))
+  packed = PackedRefs(str(path))
+  assert packed.get('refs/heads/a') == '2' * 40
+  assert packed.get('refs/heads/z') == '1' * 40
+
+def test_ref_store_matches_git(tmp_path):
+  git(tmp_path, 'init', '-q', '-b', 'master')
+  git(tmp_path, 'commit', '-q', '--allow-empty', '-m', 'Initial')
+  git(tmp_path, 'branch', 'packed')
+  git(tmp_path, 'update-ref', 'refs/remotes/origin/packed', 'HEAD')
+  git(tmp_path, 'pack-refs', '--all')
+  git(tmp_path, 'branch', 'feature/loose')
+  git(tmp_path, 'tag', 'ambiguous')
+  git(tmp_path, 'branch', 'ambiguous')
+  store = RefStore(str(tmp_path / '.git'))
+  for args in [('master',), ('packed', 'origin/packed', 'feature/loose'),
+               ('--symbolic-full-name', 'HEAD'), ('--symbolic-full-name', 'packed'),
+               ('--symbolic-full-name', 'origin/packed'), ('--abbrev-ref', 'HEAD'),
+               ('--abbrev-ref', 'packed'), ('--abbrev-ref', 'origin/packed'),
+               ('--abbrev-ref', 'heads/ambiguous')]:
+    assert store.revparse(*args) == git(tmp_path, 'rev-parse', *args), args
+  git(tmp_path, 'checkout', '-q', '--detach')
+  assert store.revparse('--abbrev-ref', 'HEAD') == 'HEAD'
+  assert store.revparse('HEAD') == git(tmp_path, 'rev-parse', 'HEAD')
+
+def test_ref_store_defers_to_git(tmp_path):
+  store = RefStore(str(tmp_path))
+  assert store.revparse('master~1') is None
+  assert store.revparse('--short', 'master') is None
+  assert store.revparse('--abbrev-ref', 'master@{upstream}') is None
+  assert store.revparse('does-not-exist') is None
+
+def test_find_git_dir(tmp_path, monkeypatch):
+  monkeypatch.delenv('GIT_DIR', raising = False)
+  git(tmp_path, 'init', '-q')
+  (tmp_path / 'sub').mkdir()
+  assert findGitDir(str(tmp_path)) == '.git'
+  assert findGitDir(str(tmp_path / 'sub')) == str(tmp_path / '.git')
@@ -0,0 +1,48 @@
+__all__ = ['Screen']
+
+class Screen(object):
+  """Remembers the last frame drawn to a terminal, so the next one only redraws changed lines.
+
+  Lines are compared as strings, escape codes included, and addressed by row; the output for a
+  frame is built up and written in one go, so the terminal never shows a half-drawn frame.
+  """
+  def __init__(self):
+    self._lines = None
+    self._size = None
+
+  def reset(self):
+    """Forgets the last frame, e.g. after something else has written to the terminal."""
+    self._lines = None
+    self._size = None
+
+  def diff(self, lines, size = None):
+    """Returns the escape codes and text that turn the last frame into lines.
+
+    size is the terminal's (rows, columns), if known. If it changes the terminal may have
+    reflowed the last frame, so the whole frame is redrawn. So is a frame too tall to fit on the
+    terminal, as rows scrolled off the top can no longer be addressed.
+    """
+    lines = list(lines)
+    previous = self._lines
+    if previous is None or size != self._size or (size and len(lines) >= size[0]):
+      chunks = ['\x1b[H']
+      for line in lines:
+        chunks.append(line + '\x1b[K\n')
+      chunks.append('\x1b[J')
+      self._lines = None if size and len(lines) >= size[0] else lines
+      self._size = size
+      return ''.join(chunks)
+    chunks = []
+    for i, line in enumerate(lines):
+      if i >= len(previous) or previous[i] != line:
+        chunks.append('\x1b[%d;1H%s\x1b[K' % (i + 1, line))
+    if len(lines) < len(previous):
+      chunks.append('\x1b[%d;1H\x1b[J' % (len(lines) + 1))
+    chunks.append('\x1b[%d;1H' % (len(lines) + 1))
+    self._lines = lines
+    return ''.join(chunks)
+
+  def draw(self, out, lines, size = None):
+    """Writes the changes since the last frame to out in a single write, and flushes it."""
+    out.write(self.diff(lines, size))
+    out.flush()
@@ -0,0 +1,40 @@
+from .git_graph_branch import TerminalBuffer
+from .screen import Screen
+
+def test_first_frame_is_drawn_in_full():
+  screen = Screen()
+  assert screen.diff(['a', 'b']) == '\x1b[Ha\x1b[K\nb\x1b[K\n\x1b[J'
+
+def test_only_changed_lines_are_redrawn():
+  screen = Screen()
+  screen.diff(['a', 'b', 'c'])
+  assert screen.diff(['a', 'B', 'c']) == '\x1b[2;1HB\x1b[K\x1b[4;1H'
+  assert screen.diff(['a', 'B', 'c']) == '\x1b[4;1H'
+
+def test_added_and_removed_lines():
+  screen = Screen()
+  screen.diff(['a', 'b'])
+  assert screen.diff(['a', 'b', 'c']) == '\x1b[3;1Hc\x1b[K\x1b[4;1H'
+  assert screen.diff(['a']) == '\x1b[2;1H\x1b[J\x1b[2;1H'
+
+def test_redraws_in_full_after_reset_or_resize():
+  screen = Screen()
+  screen.diff(['a'], (24, 80))
+  assert screen.diff(['a'], (24, 80)) == '\x1b[2;1H'
+  assert screen.diff(['a'], (24, 100)) == '\x1b[Ha\x1b[K\n\x1b[J'
+  screen.reset()
+  assert screen.diff(['a'], (24, 100)) == '\x1b[Ha\x1b[K\n\x1b[J'
+
+def test_frames_taller_than_the_terminal_are_drawn_in_full():
+  screen = Screen()
+  lines = [str(i) for i in range(5)]
+  screen.diff(lines, (5, 80))
+  assert screen.diff(lines, (5, 80)).startswith('\x1b[H')
+
+def test_draw_writes_once():
+  writes = []
+  class Out(TerminalBuffer):
+    def write(self, s):
+      writes.append(s)
+  Screen().draw(Out(), ['a', 'b'])
+  assert len(writes) == 1
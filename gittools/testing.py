@@ -0,0 +1,20 @@
+"""Helpers shared by the tests."""
+import subprocess
+from .lazy import lazy_invalidation
+
+__all__ = ['forgetLazyResults', 'git']
+
+def git(path, *args):
+  """Runs git in path as a fixed test user, returning its output, stripped."""
+  return subprocess.check_output(
+      ('git', '-C', str(path), '-c', 'user.name=T', '-c', 'user.email=t@t') + args
+  ).decode('utf-8').strip()
+
+def forgetLazyResults():
+  """Invalidates every lazy result that watches git, and everything computed from them.
+
+  Entering a lazy_invalidation context does exactly this, so results computed in one test's
+  repository are never served in the next.
+  """
+  with lazy_invalidation():
+    pass
@@ -1,10 +1,11 @@
-import errno, os, select, signal, subprocess
-from collections import namedtuple
+import atexit, codecs, errno, os, select, signal, subprocess, sys, threading, time
+from collections import deque, namedtuple
 from functools import update_wrapper
 from .lazy import lazy
 from .listener import SignalListener
 
-__all__ = ['first', 'fractionalSeconds', 'staticproperty', 'window_size', 'LazyList', 'Sh', 'ShError']
+__all__ = ['commandName', 'first', 'fractionalSeconds', 'staticproperty', 'window_size', 'LazyList',
+           'Sh', 'ShAccounting', 'ShError', 'ShRecord']
 
 def fractionalSeconds(delta):
   return delta.total_seconds() + delta.microseconds / 10000000.0
@@ -41,12 +42,95 @@ class ShError(Exception):
   def __repr__(self):
     return 'ShError(%s, %s, %s)' % (repr(self.returncode), repr(self.cmd), repr(self.stderr))
 
+# A command that has exited: its argv, time.perf_counter() times, stdout and stderr bytes read,
+# and exit status
+ShRecord = namedtuple('ShRecord', 'cmd start end bytesRead returncode')
+
+def commandName(cmd):
+  """Returns a short name for a command, e.g. 'git log' for ('/usr/bin/git', 'log', ...)."""
+  name = os.path.basename(cmd[0])
+  subcommand = next((arg for arg in cmd[1:] if not arg.startswith('-')), None)
+  return name + ' ' + subcommand if subcommand else name
+
 class Sh:
-  def __init__(self, *cmd):
+  """Runs a command, iterating over the lines of its standard output.
+
+  Output is read in large chunks and split into lines on bytes, so long outputs like
+  `git log` over a big repository stream at close to pipe speed. Use batches() to receive
+  each chunk's lines as a list, skipping the per-line iterator overhead.
+  """
+  BUFFER_SIZE = 1 << 16
+
+  hooks = ()  # Copy-on-write; see addHook
+  startHooks = ()  # Copy-on-write; see addStartHook
+  _hooksLock = threading.Lock()
+
+  @staticmethod
+  def addHook(hook):
+    """Calls hook(ShRecord) each time a command exits, on whichever thread saw it exit."""
+    with Sh._hooksLock:
+      Sh.hooks = Sh.hooks + (hook,)
+
+  @staticmethod
+  def removeHook(hook):
+    with Sh._hooksLock:
+      hooks = list(Sh.hooks)
+      hooks.remove(hook)
+      Sh.hooks = tuple(hooks)
+
+  @staticmethod
+  def addStartHook(hook):
+    """Calls hook(cmd) each time a command starts, including ones never waited on."""
+    with Sh._hooksLock:
+      Sh.startHooks = Sh.startHooks + (hook,)
+
+  @staticmethod
+  def removeStartHook(hook):
+    with Sh._hooksLock:
+      hooks = list(Sh.startHooks)
+      hooks.remove(hook)
+      Sh.startHooks = tuple(hooks)
+
+  @staticmethod
+  def starting(cmd):
+    """Passes a command about to start to every start hook, including ones not run by Sh."""
+    for hook in Sh.startHooks:
+      hook(tuple(cmd))
+
+  @staticmethod
+  def report(cmd, start, bytesRead, returncode):
+    """Passes a command that has just exited to every hook, including ones not run by Sh."""
+    hooks = Sh.hooks
+    if hooks:
+      record = ShRecord(tuple(cmd), start, time.perf_counter(), bytesRead, returncode)
+      for hook in hooks:
+        hook(record)
+
+  def __init__(self, *cmd, input = None):
+    """Starts cmd, writing input (bytes), if given, to its standard input.
+
+    input is written in full before any output is read, so it suits commands that read all
+    their input first, like `git log --stdin`.
+    """
     self.cmd = cmd
-    self._process = subprocess.Popen(cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-    self._out = []
+    Sh.starting(cmd)
+    self._start = time.perf_counter()
+    self._bytesRead = 0
+    self._process = subprocess.Popen(
+        cmd, stdin = None if input is None else subprocess.PIPE,
+        stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    if input is not None:
+      try:
+        self._process.stdin.write(input)
+      except OSError:
+        pass  # The command exited without reading it all; its exit status will say why
+      finally:
+        self._process.stdin.close()
+        self._process.stdin = None
+    self._buffer = bytearray()  # Output read after the last complete line
+    self._lines = deque()
     self._err = []
+    self._errDecoder = codecs.getincrementaldecoder('utf-8')()
 
   def execute(self):
     with self as lines:
@@ -56,16 +140,13 @@ class Sh:
   def __iter__(self):
     return self
 
-  def __next__(self):
-    # Note: no universal newline support
-    if len(self._out) == 1:
-      lf = self._out[0].find('\n')
-      if lf != -1:
-        line = self._out[0][:lf]
-        self._out[0] = self._out[0][lf+1:]
-        return line
+  def _fill(self):
+    """Reads from the process until at least one more line of output is complete.
+
+    Returns False once both stdout and stderr are exhausted.
+    """
     read_set = [ v for v in (self._process.stdout, self._process.stderr) if v ]
-    while read_set:
+    while read_set and not self._lines:
       try:
         rlist, _, _ = select.select(read_set, [], [])
       except select.error as e:
@@ -73,52 +154,85 @@ class Sh:
           continue
         raise
       if self._process.stderr in rlist:
-        data = os.read(self._process.stderr.fileno(), 1024).decode('utf-8')
-        if data == "":
+        data = os.read(self._process.stderr.fileno(), Sh.BUFFER_SIZE)
+        self._bytesRead += len(data)
+        self._err.append(self._errDecoder.decode(data, final = not data))
+        if not data:
           self._process.stderr.close()
           read_set.remove(self._process.stderr)
           self._process.stderr = None
-        else:
-          self._err.append(data)
       if self._process.stdout in rlist:
-        data = os.read(self._process.stdout.fileno(), 1024).decode('utf-8')
-        if data == "":
+        data = os.read(self._process.stdout.fileno(), Sh.BUFFER_SIZE)
+        self._bytesRead += len(data)
+        if not data:
           self._process.stdout.close()
           read_set.remove(self._process.stdout)
           self._process.stdout = None
         else:
-          lf = data.find('\n')
-          if lf != -1:
-            line = ''.join(self._out) + data[:lf]
-            self._out = [data[lf+1:]]
-            return line
-          self._out.append(data)
-    if self._out:
-      line = ''.join(self._out)
-      self._out = []
-      if line:
-        return line
+          # Note: no universal newline support
+          lf = data.rfind(b'\n')
+          if lf == -1:
+            self._buffer += data
+          else:
+            # A newline byte never occurs inside a multi-byte UTF-8 sequence, so complete
+            # lines can be decoded together, independently of the rest of the output
+            self._buffer += data[:lf]
+            self._lines.extend(self._buffer.decode('utf-8').split('\n'))
+            self._buffer = bytearray(data[lf + 1:])
+    return bool(self._lines)
+
+  def _finish(self):
+    """Returns any final unterminated line, or raises once the process has exited."""
+    if self._buffer:
+      line = self._buffer.decode('utf-8')
+      self._buffer = bytearray()
+      return line
     self._process.wait()
+    self._exited()
     if self._process.returncode:
       raise ShError(self._process.returncode, self.cmd, ''.join(self._err))
     else:
       raise StopIteration()
 
+  def _exited(self):
+    if self._start is not None:
+      Sh.report(self.cmd, self._start, self._bytesRead, self._process.returncode)
+      self._start = None
+
+  def __next__(self):
+    if self._lines or self._fill():
+      return self._lines.popleft()
+    return self._finish()
+
+  def batches(self):
+    """Yields the remaining output as lists of lines, as they become available."""
+    while True:
+      if self._lines or self._fill():
+        batch = list(self._lines)
+        self._lines.clear()
+        yield batch
+      else:
+        try:
+          yield [self._finish()]
+        except StopIteration:
+          return
+
   def _communicate(self):
-    bout, berr = self._process.communicate()
-    out = bout.decode('utf-8')
-    err = berr.decode('utf-8')
+    bout, berr = self._process.communicate()  # None for streams already read to the end
+    self._bytesRead += len(bout or b'') + len(berr or b'')
+    out = ''.join(l + '\n' for l in self._lines) + (self._buffer + (bout or b'')).decode('utf-8')
+    err = self._errDecoder.decode(berr or b'', final = True)
 
     self._process.stdout = self._process.stderr = None
-    self._out.append(out)
-    out = ''.join(self._out)
-    self._out = []
+    self._lines.clear()
+    self._buffer = bytearray()
     if err:
       self._err.append(err)
     return out
 
   def __str__(self):
     out = self._communicate()
+    self._exited()
     if self._process.returncode:
       raise ShError(self._process.returncode, self.cmd, ''.join(self._err))
     return out
@@ -141,6 +255,73 @@ class Sh:
       self._process.wait()
     except OSError:
       pass
+    self._exited()
+
+def shSummary(records):
+  """Returns a table of the given ShRecords, grouped by command, most time-consuming first."""
+  byName = {}
+  for record in records:
+    byName.setdefault(commandName(record.cmd), []).append(record)
+  lines = ['%d commands, %.1f ms, %.1f KiB read, %d failed' % (
+      len(records), sum(r.end - r.start for r in records) * 1000,
+      sum(r.bytesRead for r in records) / 1024.0,
+      sum(1 for r in records if r.returncode and r.returncode > 0))]
+  stopped = sum(1 for r in records if r.returncode and r.returncode < 0)
+  if stopped:
+    lines[0] += ', %d stopped by a signal' % stopped
+  if byName:
+    lines.append('%7s %10s %10s %10s  %s' % ('count', 'total ms', 'max ms', 'KiB read', 'command'))
+    for name, group in sorted(byName.items(), key = lambda item: -sum(r.end - r.start
+                                                                        for r in item[1])):
+      times = [r.end - r.start for r in group]
+      lines.append('%7d %10.1f %10.1f %10.1f  %s' % (
+          len(group), sum(times) * 1000, max(times) * 1000,
+          sum(r.bytesRead for r in group) / 1024.0, name))
+  return '\n'.join(lines) + '\n'
+
+class ShAccounting(object):
+  """Records every command started while in the context, e.g. to hold code to a budget.
+
+  Commands are counted as they start, so streams that are never read to the end, and so
+  never exit in the context, still count; records holds those that have exited. Set
+  GITTOOLS_SH_SUMMARY=1 to print a summary of every command a run spawns on exit.
+  """
+  def __init__(self):
+    self.started = []  # The argv of each command started
+    self.records = []
+
+  def __call__(self, record):
+    self.records.append(record)
+
+  def __enter__(self):
+    Sh.addStartHook(self.started.append)
+    Sh.addHook(self)
+    return self
+
+  def __exit__(self, type, value, traceback):
+    Sh.removeHook(self)
+    Sh.removeStartHook(self.started.append)
+
+  def __len__(self):
+    return len(self.started)
+
+  @property
+  def running(self):
+    """How many commands started in the context have not been seen to exit."""
+    return max(0, len(self.started) - len(self.records))
+
+  def summary(self):
+    summary = shSummary(self.records)
+    if self.running:
+      summary += '%d still running\n' % self.running
+    return summary
+
+def _summarizeOnExit():
+  accounting = ShAccounting().__enter__()  # Never exited, so it sees every command
+  atexit.register(lambda: sys.stderr.write('Subprocesses: ' + accounting.summary()))
+
+if os.environ.get('GITTOOLS_SH_SUMMARY'):
+  _summarizeOnExit()
 
 def first(collection, default=None):
   return next(iter(collection), default)
@@ -1,5 +1,6 @@
 # coding=utf-8
-from .utils import Sh, ShError
+import os, subprocess, sys
+from .utils import commandName, Sh, ShAccounting, ShError
 
 def test_iteration_no_newline_no_error():
   x = Sh('printf', 'hello')
@@ -56,6 +57,50 @@ def test_iteration_error_stdout_no_stderr():
   except ShError as e:
     pass
 
+def test_iteration_multibyte_characters_split_across_reads(monkeypatch):
+  monkeypatch.setattr(Sh, 'BUFFER_SIZE', 1)
+  x = Sh('printf', r'h\xc3\xa9llo\nw\xc3\xb6rld\n\xe2\x9c\x93')
+  assert ['héllo', 'wörld', '✓'] == list(x)
+
+def test_iteration_error_multibyte_stderr(monkeypatch):
+  monkeypatch.setattr(Sh, 'BUFFER_SIZE', 1)
+  p = Sh('bash', '-c', r'printf "\xc3\xa9rror\n" >&2; false')
+  try:
+    next(p)
+    assert False and 'Expected ShError'
+  except ShError as e:
+    assert 'érror\n' == e.stderr
+
+def test_batches():
+  x = Sh('bash', '-c', 'for i in {1..1000}; do echo $i; done; printf end')
+  lines = [line for batch in x.batches() for line in batch]
+  assert [str(i) for i in range(1, 1001)] + ['end'] == lines
+
+def test_batches_after_next():
+  x = Sh('bash', '-c', 'echo a; echo b; echo c')
+  assert 'a' == next(x)
+  assert ['b', 'c'] == [line for batch in x.batches() for line in batch]
+
+def test_batches_error():
+  p = Sh('bash', '-c', 'echo hello; false')
+  try:
+    list(p.batches())
+    assert False and 'Expected ShError'
+  except ShError as e:
+    assert 1 == e.returncode
+
+def test_str_after_next():
+  x = Sh('bash', '-c', 'echo a; echo b; printf c')
+  assert 'a' == next(x)
+  assert 'b\nc' == str(x)
+
+def test_str_after_streams_closed():
+  x = Sh('bash', '-c', 'echo a; exec 2>&-; sleep 0.1; echo b')
+  assert 'a' == next(x)
+  while x._process.stderr is not None:
+    x._fill()
+  assert 'b\n' == str(x)
+
 def test_str_no_error_no_newline():
   output = str(Sh('printf', 'hello'))
   assert 'hello' == output
@@ -87,8 +132,58 @@ def test_repr():
   assert "Sh('false')" == repr(p)
 
 def test_context_management():
-  with Sh('echo', 'hello') as p:
+  with Sh('sleep', '10') as p:  # Still running when the context kills it
     assert p._process.returncode is None
   assert p._process.returncode is not None
   assert p._process.returncode != 0
 
+def test_hooks_record_commands():
+  with ShAccounting() as accounting:
+    assert 'hello\n' == str(Sh('echo', 'hello'))
+    assert ['a', 'b'] == list(Sh('printf', r'a\nb'))
+    try:
+      list(Sh('bash', '-c', 'echo oops >&2; exit 3'))
+    except ShError:
+      pass
+  assert Sh.hooks == ()
+  assert [(r.cmd[0], r.bytesRead, r.returncode) for r in accounting.records] == [
+      ('echo', 6, 0), ('printf', 3, 0), ('bash', 5, 3)]
+  assert all(r.end >= r.start for r in accounting.records)
+  assert len(accounting) == 3
+  summary = accounting.summary().splitlines()
+  assert summary[0] == '3 commands, %s ms, 0.0 KiB read, 1 failed' % summary[0].split()[2]
+  assert any(l.split()[0] == '1' and l.endswith('  echo hello') for l in summary[2:])
+
+def test_hooks_called_once_per_command():
+  with ShAccounting() as accounting:
+    with Sh('echo', 'hello') as p:
+      next(p)
+    str(Sh('true'))
+  assert [r.cmd for r in accounting.records] == [('echo', 'hello'), ('true',)]
+
+def test_accounting_counts_commands_never_read_to_the_end():
+  with ShAccounting() as accounting:
+    stream = Sh('yes')
+    next(stream)
+  assert len(accounting) == 1
+  assert accounting.running == 1
+  assert accounting.summary().endswith('1 still running\n')
+  assert Sh.startHooks == ()
+  with ShAccounting() as accounting:
+    stream.__exit__(None, None, None)
+  assert accounting.summary().startswith('1 commands, ')
+  assert ', 0 failed, 1 stopped by a signal' in accounting.summary()
+
+def test_summary_from_environment():
+  env = dict(os.environ, GITTOOLS_SH_SUMMARY = '1')
+  script = ('from gittools.utils import Sh; str(Sh("true")); str(Sh("true")); '
+            'next(iter(Sh("yes")))')  # A stream never read to the end
+  result = subprocess.run((sys.executable, '-c', script), env = env, stderr = subprocess.PIPE,
+                          cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+  summary = result.stderr.decode('utf-8')
+  assert summary.startswith('Subprocesses: 2 commands, ')
+  assert summary.endswith('\n1 still running\n')
+
+def test_command_name():
+  assert commandName(('/usr/bin/git', '-c', 'log', '--format=%H')) == 'git log'
+  assert commandName(('git', '--version')) == 'git'
@@ -0,0 +1,55 @@
+import re
+from .lazy import lazy
+
+__all__ = ['Viewport']
+
+KEY = re.compile(r'\x1b\[[0-9;]*[~A-Za-z]|\x1bO[A-Za-z]|.', re.DOTALL)
+
+# (lines, pages) to scroll by, or None/'end' to jump to the top/bottom
+SCROLL_KEYS = {
+  'j': (1, 0), '\x1b[B': (1, 0), '\x1bOB': (1, 0),
+  'k': (-1, 0), '\x1b[A': (-1, 0), '\x1bOA': (-1, 0),
+  ' ': (0, 1), 'f': (0, 1), '\x1b[6~': (0, 1),
+  'b': (0, -1), '\x1b[5~': (0, -1),
+  'g': None, '\x1b[H': None, '\x1b[1~': None,
+  'G': 'end', '\x1b[F': 'end', '\x1b[4~': 'end',
+}
+
+class Viewport(object):
+  """The rows of the graph shown in --watch mode, scrolled with the keyboard if keys is given.
+
+  keys is a KeyListener. Reading it is lazy, so a keypress invalidates whatever called
+  visible(), and only the rows scrolled into view need to be formatted.
+  """
+  def __init__(self, keys = None):
+    self.top = 0
+    self._keys = keys
+    self._scrolls = []
+    if keys is not None:
+      self._readKeys = lazy(listener = keys)(self._readKeys)
+
+  def _readKeys(self):
+    while self._keys.keys:
+      for key in KEY.findall(self._keys.keys.popleft()):
+        if key in SCROLL_KEYS:
+          self._scrolls.append(SCROLL_KEYS[key])
+
+  def scroll(self, lines = 0, pages = 0):
+    self._scrolls.append((lines, pages))
+
+  def visible(self, count, height):
+    """Returns the range of the count rows to show, at most height of them."""
+    if self._keys is not None:
+      self._readKeys()
+    height = max(1, height)
+    for scroll in self._scrolls:
+      if scroll is None:
+        self.top = 0
+      elif scroll == 'end':
+        self.top = count
+      else:
+        lines, pages = scroll
+        self.top += lines + pages * height
+    del self._scrolls[:]
+    self.top = max(0, min(self.top, count - height))
+    return range(self.top, min(count, self.top + height))
@@ -0,0 +1,58 @@
+from collections import deque
+from .lazy import lazy, lazy_invalidation
+from .viewport import Viewport
+
+class FakeKeys(object):
+  callback = None
+
+  def __init__(self):
+    self.keys = deque()
+
+  def watch(self, callback):
+    self.callback = callback
+
+  def unwatch(self):
+    self.callback = None
+
+  def press(self, data):
+    self.keys.append(data)
+    self.callback()
+
+def test_visible_without_scrolling():
+  viewport = Viewport()
+  assert viewport.visible(100, 10) == range(0, 10)
+  assert viewport.visible(5, 10) == range(0, 5)
+
+def test_scroll_is_clamped():
+  viewport = Viewport()
+  viewport.scroll(lines = 3)
+  assert viewport.visible(100, 10) == range(3, 13)
+  viewport.scroll(pages = 20)
+  assert viewport.visible(100, 10) == range(90, 100)
+  assert viewport.visible(50, 10) == range(40, 50)  # Rows removed from the end
+  viewport.scroll(lines = -100)
+  assert viewport.visible(50, 10) == range(0, 10)
+
+def test_keys_invalidate_and_scroll():
+  keys = FakeKeys()
+  viewport = Viewport(keys)
+  renders = []
+  @lazy
+  def render():
+    renders.append(viewport.visible(100, 10))
+  with lazy_invalidation():
+    render()
+    assert keys.callback is not None
+    keys.press('jj\x1b[B')
+    render()
+    keys.press(' ')
+    render()
+    keys.press('G')
+    render()
+    keys.press('kg')
+    render()
+    keys.press('x')  # Not a scroll key; redrawn, but not moved
+    render()
+    render()
+  assert renders == [range(0, 10), range(3, 13), range(13, 23), range(90, 100),
+                     range(0, 10), range(0, 10)]
@@ -1,4 +1,4 @@
-import os.path, sys, watchdog.events, watchdog.observers
+import os.path, sys
 from .git import git_dir, Branch, GitListener, GitLockWatcher
 from itertools import islice
 from .lazy import lazy, lazy_invalidation
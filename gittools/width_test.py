@@ -0,0 +1,40 @@
+from .width import StyledLine, charWidth, textWidth, truncate
+
+def test_char_width():
+  assert charWidth('a') == 1
+  assert charWidth('─') == 1
+  assert charWidth('①') == 1
+  assert charWidth('🔶') == 2
+  assert charWidth('⌛') == 2
+  assert charWidth('語') == 2
+  assert charWidth('́') == 0  # Combining acute accent
+  assert charWidth('​') == 0  # Zero width space
+
+def test_text_width():
+  assert textWidth('') == 0
+  assert textWidth('feature/foo') == 11
+  assert textWidth('┬  feat 🔶 💚🔥') == 15
+  assert textWidth('café') == 4
+
+def test_truncate():
+  assert truncate('feature/foo', 20) == 'feature/foo'
+  assert truncate('feature/foo', 8) == 'feature…'
+  assert truncate('日本語の名前', 7) == '日本語…'
+  assert truncate('日本語の名前', 6, '') == '日本語'
+  assert truncate('abc', 0) == '…'
+
+def test_styled_line():
+  line = StyledLine()
+  line.set('graph', '┬  ')
+  line.set('name', 'feat', '1;35')
+  line.set('remotes', ' 🔶')
+  line.set('unmerged', ' ② unmerged', '1;31')
+  assert line.width == 3 + 4 + 3 + 11
+  assert line.render() == '┬  \x1b[1;35mfeat\x1b[0m 🔶\x1b[1;31m ② unmerged\x1b[0m'
+  assert line.render(styled = False) == '┬  feat 🔶 ② unmerged'
+  line.set('unmerged', ' ② ', '1;31')
+  assert line.width == 3 + 4 + 3 + 3
+  assert line['name'] == 'feat'
+  assert line.segmentWidth('remotes') == 3
+  line.set('ci', '')
+  assert line.render(styled = False) == '┬  feat 🔶 ② '